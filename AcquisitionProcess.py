@@ -0,0 +1,223 @@
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from KeysightDAC import KeysightDAC
+
+class SharedBlockRing:
+    """
+    Ring of decoded blocks living in a multiprocessing.shared_memory segment.
+
+    Layout: a small float64 header (sampling rate and running counters), one
+    float64 metadata row per slot (sequence, host time, sample count,
+    overflow) and the float32 (slots, channels, samples) values. The writer
+    fills slot sequence % slot_nbr and then publishes (slot, sequence) on the
+    index queue; a reader checks the sequence stored in the slot again after
+    reading to know the slot was not overwritten meanwhile.
+    """
+    HEADER_FIELDS = ('sampling_rate', 'blocks', 'overflow_blocks', 'dropped_indices')
+    META_FIELDS = ('sequence', 'host_time', 'sample_nbr', 'overflow')
+
+    def __init__(self, slot_nbr, channel_nbr, sample_points, name=None):
+        self.slot_nbr = slot_nbr
+        self.channel_nbr = channel_nbr
+        self.sample_points = sample_points
+
+        header_size = 8 * len(self.HEADER_FIELDS)
+        meta_size = 8 * slot_nbr * len(self.META_FIELDS)
+        values_size = 4 * slot_nbr * channel_nbr * sample_points
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=header_size + meta_size + values_size)
+        else:
+            self.shm = self.attach(name)
+
+        self.header = np.ndarray(len(self.HEADER_FIELDS), dtype=np.float64, buffer=self.shm.buf)
+        self.meta = np.ndarray((slot_nbr, len(self.META_FIELDS)), dtype=np.float64, buffer=self.shm.buf, offset=header_size)
+        self.values = np.ndarray((slot_nbr, channel_nbr, sample_points), dtype=np.float32, buffer=self.shm.buf, offset=header_size + meta_size)
+        if name is None:
+            self.header[:] = 0
+            self.meta[:, 0] = -1
+
+    @staticmethod
+    def attach(name):
+        # Only the creator may unlink the segment: keep the resource tracker of
+        # an attaching process from destroying it when that process exits
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            # Before 3.13: Windows has no tracker, and the children of
+            # multiprocessing share the tracker of their parent, where the
+            # segment is registered once and unregistered by unlink()
+            if os.name == 'posix' and multiprocessing.parent_process() is None:
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            return shm
+
+    def attach_args(self):
+        return self.slot_nbr, self.channel_nbr, self.sample_points, self.shm.name
+
+    def header_value(self, field):
+        return self.header[self.HEADER_FIELDS.index(field)]
+
+    def read_block(self, slot, sequence, out=None):
+        """
+        Copy a published block out of the ring.
+
+        Returns None when the writer already reused the slot for a newer block.
+        """
+        if self.meta[slot, 0] != sequence:
+            return None
+        sample_nbr = int(self.meta[slot, 2])
+        if out is None:
+            out = np.empty((self.channel_nbr, sample_nbr), dtype=np.float32)
+        out[:, :sample_nbr] = self.values[slot, :, :sample_nbr]
+        if self.meta[slot, 0] != sequence:
+            return None
+        return out[:, :sample_nbr]
+
+    def close(self):
+        # Drop the numpy views first, the segment can't be closed while exported
+        self.header = self.meta = self.values = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+class AcquisitionProcess(multiprocessing.Process):
+    """
+    Run the KeysightDAC reader and decoder in a process of its own.
+
+    USB reads and decoding then never wait on the GIL of the process that
+    renders. Decoded blocks are published through a SharedBlockRing and their
+    (slot, sequence) through a bounded index queue; when the consumer lags,
+    indices are dropped (counted in dropped_indices), never the acquisition.
+
+    channel_config maps every scanlist channel to (voltage_range, polarity).
+    """
+    def __init__(self, usb_address, scanlist, channel_config, sampling_rate, sample_points, slot_nbr=16):
+        super().__init__(daemon=True)
+        self.usb_address = usb_address
+        self.scanlist = list(scanlist)
+        self.channel_config = dict(channel_config)
+        self.sampling_rate = sampling_rate
+        self.sample_points = sample_points
+        self.ring = SharedBlockRing(slot_nbr, len(self.scanlist), sample_points)
+        self.index_queue = multiprocessing.Queue(maxsize=slot_nbr)
+        self.ready = multiprocessing.Event()
+        self.failed = multiprocessing.Event()
+        self.running = multiprocessing.Event()
+        self.running.set()
+
+    def __getstate__(self):
+        # Only the segment name crosses the process boundary, not its views
+        state = self.__dict__.copy()
+        state['ring'] = self.ring.attach_args()
+        return state
+
+    def __setstate__(self, state):
+        # The ring is attached in run(): while unpickled, the child is not
+        # bootstrapped yet and parent_process() is still None
+        self.__dict__.update(state)
+
+    def run(self):
+        if not isinstance(self.ring, SharedBlockRing):
+            self.ring = SharedBlockRing(*self.ring)
+        try:
+            self.acquire()
+        except BaseException:
+            # Let wait_ready() in the parent fail at once rather than wait for ready
+            self.failed.set()
+            raise
+        finally:
+            self.ring.close()
+
+    def acquire(self):
+        dac = KeysightDAC(self.usb_address)
+        dac.connect()
+        try:
+            dac.define_sampling_rate(self.sampling_rate)
+            dac.define_sample_points(self.sample_points)
+            dac.configure_scanlist(self.scanlist)
+            for channel in self.scanlist:
+                dac.configure_output(channel, *self.channel_config[channel])
+
+            dac.start_acquisition()
+            self.ring.header[0] = dac.sampling_rate
+            self.ready.set()
+
+            raw = dac.block_buffer()
+            sequence = 0
+            while self.running.is_set():
+                if not dac.wait_for_data(timeout=0.1):
+                    continue
+                host_time = dac.ready_time
+                overflow = dac.is_overflow(dac.last_status)
+                slot = sequence % self.ring.slot_nbr
+
+                dac.fetch_block(raw)
+                self.ring.meta[slot, 0] = -1  # Invalidate while writing
+                sample_nbr = dac.convert_raw_values_into(raw, self.ring.values[slot])
+                self.ring.meta[slot, 1:] = (host_time, sample_nbr, overflow)
+                self.ring.meta[slot, 0] = sequence
+
+                self.ring.header[1] += 1
+                self.ring.header[2] += overflow
+                try:
+                    self.index_queue.put_nowait((slot, sequence))
+                except queue.Full:
+                    self.ring.header[3] += 1
+                sequence += 1
+        finally:
+            dac.stop_acquisition()
+            dac.close()
+
+    def wait_ready(self, timeout=None):
+        """
+        Wait until the acquisition runs; returns False when timeout expired first.
+
+        Raises RuntimeError when the process failed or exited before.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.ready.wait(0.1):
+            if self.failed.is_set() or not self.is_alive():
+                self.join(1.0)
+                raise RuntimeError(f"Acquisition process failed before it was ready (exit code {self.exitcode})")
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+        return True
+
+    def get_sampling_rate(self):
+        return self.ring.header_value('sampling_rate')
+
+    def blocks(self, timeout=0.0):
+        """
+        Yield every block published since the last call as (sequence, host_time, values).
+
+        values is a copy owned by the caller; blocks overwritten before they
+        could be read are skipped.
+        """
+        try:
+            slot, sequence = self.index_queue.get(timeout=timeout) if timeout else self.index_queue.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            # host_time is checked along with the values by the sequence test of read_block
+            host_time = self.ring.meta[slot, 1]
+            values = self.ring.read_block(slot, sequence)
+            if values is not None:
+                yield sequence, host_time, values
+            try:
+                slot, sequence = self.index_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def summary(self):
+        return {field: float(self.ring.header_value(field)) for field in self.ring.HEADER_FIELDS}
+
+    def stop(self, timeout=2.0):
+        self.running.clear()
+        self.join(timeout)
+        self.ring.close()
+        self.ring.unlink()
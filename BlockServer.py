@@ -0,0 +1,275 @@
+import json
+import queue
+import socket
+import struct
+import threading
+import numpy as np
+from DataAcquisition import BlockQueue
+
+DEFAULT_ADDRESS = ('127.0.0.1', 50230)
+
+# Every frame: magic, frame type, channel count, sequence, host time, sample count,
+# blocks this subscriber missed so far, payload length; then the payload
+FRAME_HEADER = struct.Struct('<4sBBHQdIII')
+FRAME_MAGIC = b'U2BK'
+METADATA, DECODED, RAW = 0, 1, 2
+# Sent by a subscriber after connecting: wanted frame type, 1 for lossless
+SUBSCRIBE = struct.Struct('<BB')
+
+def open_socket(address):
+    """A str address is a Unix socket path, a (host, port) tuple a TCP address."""
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+def encode_frame(frame_type, channel_nbr, sequence, host_time, sample_nbr, dropped, payload):
+    return FRAME_HEADER.pack(FRAME_MAGIC, frame_type, 0, channel_nbr, sequence, host_time, sample_nbr, dropped, len(payload)) + payload
+
+class Subscriber:
+    """
+    One connected consumer with its own queue and sender thread.
+
+    A subscriber accepting drops gets a small DROP_OLDEST queue; a lossless
+    one a deep queue, and is disconnected if it still falls behind, so a
+    slow consumer never holds up the acquisition or the other subscribers.
+    """
+    def __init__(self, server, connection, frame_type, lossless):
+        self.server = server
+        self.connection = connection
+        self.frame_type = frame_type
+        self.lossless = lossless
+        if lossless:
+            self.frames = BlockQueue(server.lossless_depth, BlockQueue.BLOCK)
+        else:
+            self.frames = BlockQueue(server.drop_depth, BlockQueue.DROP_OLDEST)
+        self.connected = True
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.send_frames, daemon=True)
+
+    @property
+    def dropped(self):
+        return self.frames.dropped
+
+    def offer(self, frame):
+        try:
+            self.frames.put(frame, block=False)
+        except queue.Full:
+            self.close()
+
+    def send_frames(self):
+        try:
+            while self.connected:
+                try:
+                    frame = self.frames.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                self.connection.sendall(frame)
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        # Called by the sender thread on a socket error or by the publisher on overflow
+        with self.lock:
+            if not self.connected:
+                return
+            self.connected = False
+        self.connection.close()
+        self.server.remove(self)
+
+class BlockServer:
+    """
+    Publish the blocks of one USB session to any number of local subscribers.
+
+    metadata (scanlist, signal names, sampling rate, ranges, polarities...) is
+    sent to every subscriber first, then each block as a DECODED frame
+    (float32 volts) or a RAW frame (int16 ADC codes), depending on what the
+    subscriber asked for. Frames are encoded once per block and shared by
+    all the subscribers of the same type.
+    """
+    def __init__(self, metadata, address=DEFAULT_ADDRESS, drop_depth=8, lossless_depth=256):
+        self.metadata = metadata
+        self.address = address
+        self.drop_depth = drop_depth
+        self.lossless_depth = lossless_depth
+        self.subscribers = list()
+        self.lock = threading.Lock()
+        self.disconnected = 0
+        self.running = threading.Event()
+        self.listener = open_socket(address)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(address)
+        self.listener.listen()
+        self.listener.settimeout(0.2)
+        self.accept_thread = threading.Thread(target=self.accept, daemon=True)
+
+    def start(self):
+        self.running.set()
+        self.accept_thread.start()
+
+    def accept(self):
+        while self.running.is_set():
+            try:
+                connection, _ = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                connection.settimeout(2.0)
+                frame_type, lossless = SUBSCRIBE.unpack(receive_exact(connection, SUBSCRIBE.size))
+                connection.settimeout(None)
+                connection.sendall(encode_frame(METADATA, 0, 0, 0.0, 0, 0, json.dumps(self.metadata).encode()))
+            except (OSError, struct.error):
+                connection.close()
+                continue
+            subscriber = Subscriber(self, connection, frame_type, bool(lossless))
+            with self.lock:
+                self.subscribers.append(subscriber)
+            subscriber.thread.start()
+
+    def remove(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+                self.disconnected += 1
+
+    def publish(self, sequence, host_time, values, codes=None):
+        """
+        Send a (channels, samples) block of volts and, for RAW subscribers, its
+        codes; without codes every subscriber gets DECODED frames.
+        """
+        with self.lock:
+            subscribers = list(self.subscribers)
+        frames = dict()
+        for subscriber in subscribers:
+            frame_type = subscriber.frame_type if codes is not None else DECODED
+            if frame_type not in frames:
+                payload = np.ascontiguousarray(codes if frame_type == RAW else values, dtype='<i2' if frame_type == RAW else '<f4')
+                frames[frame_type] = (payload.shape, payload.tobytes())
+            (channel_nbr, sample_nbr), payload = frames[frame_type]
+            subscriber.offer(encode_frame(frame_type, channel_nbr, sequence, host_time or 0.0, sample_nbr, subscriber.dropped, payload))
+
+    def observe(self, info, values):
+        """DataAcquisitionThread observer publishing the decoded blocks."""
+        self.publish(info.sequence, info.host_time, values)
+
+    def serve(self, daq, running=None):
+        """Read daq until the running threading.Event is cleared, publishing both frame types."""
+        raw = daq.block_buffer()
+        values = np.empty((len(daq.scanlist), daq.sample_points), dtype=np.float32)
+        sequence = 0
+        while running is None or running.is_set():
+            if not daq.wait_for_data(timeout=0.1):
+                continue
+            host_time = daq.ready_time
+            daq.fetch_block(raw)
+            sample_nbr = daq.convert_raw_values_into(raw, values)
+            self.publish(sequence, host_time, values[:, :sample_nbr], daq.raw_codes(raw))
+            sequence += 1
+
+    def summary(self):
+        with self.lock:
+            return {
+                'subscribers': len(self.subscribers),
+                'disconnected': self.disconnected,
+                'dropped': [subscriber.dropped for subscriber in self.subscribers],
+            }
+
+    def close(self):
+        self.running.clear()
+        self.listener.close()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+
+def receive_exact(connection, size, buffer=None):
+    buffer = bytearray(size) if buffer is None else buffer
+    view = memoryview(buffer)[:size]
+    received = 0
+    while received < size:
+        count = connection.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Block server closed the connection")
+        received += count
+    return buffer
+
+class BlockSubscriber:
+    """
+    Client of a BlockServer.
+
+    With lossless=False the server may drop blocks for this subscriber when it
+    lags, the number missed so far comes with every block. Usage:
+
+        subscriber = BlockSubscriber(lossless=True)
+        for sequence, host_time, dropped, values in subscriber.blocks():
+            ...
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, frame_type=DECODED, lossless=False):
+        self.connection = open_socket(address)
+        self.connection.connect(address)
+        self.connection.sendall(SUBSCRIBE.pack(frame_type, int(lossless)))
+        header = self.read_header()
+        self.metadata = json.loads(receive_exact(self.connection, header[-1]))
+        self.buffer = bytearray()
+
+    def read_header(self):
+        magic, frame_type, _, channel_nbr, sequence, host_time, sample_nbr, dropped, size = FRAME_HEADER.unpack(receive_exact(self.connection, FRAME_HEADER.size))
+        if magic != FRAME_MAGIC:
+            raise ValueError("Not a block server frame")
+        return frame_type, channel_nbr, sequence, host_time, sample_nbr, dropped, size
+
+    def blocks(self):
+        """Yield (sequence, host_time, dropped, values); values are copies owned by the caller."""
+        while True:
+            frame_type, channel_nbr, sequence, host_time, sample_nbr, dropped, size = self.read_header()
+            if len(self.buffer) < size:
+                self.buffer = bytearray(size)
+            receive_exact(self.connection, size, self.buffer)
+            dtype = '<i2' if frame_type == RAW else '<f4'
+            values = np.frombuffer(self.buffer, dtype=dtype, count=channel_nbr * sample_nbr).reshape(channel_nbr, sample_nbr).copy()
+            yield sequence, host_time, dropped, values
+
+    def close(self):
+        self.connection.close()
+
+if __name__ == "__main__":
+    from KeysightDAC import KeysightDAC
+
+    usb_address = "USB0::0x0957::0x1118::TW47031015::0::INSTR"  # Replace with actual USB address
+    signal_name = ["5V", "3V3", "2V7", "1V8", "1V2", "1V2_S", "VUSB_S", "1V2_CAM", "1V8_CAM", "3V3_PDCD", "VUSB"]
+    dac = KeysightDAC(usb_address)
+    dac.connect()
+
+    scanlist = [dac.ANALOG_CHANNEL_1, dac.ANALOG_CHANNEL_2, dac.ANALOG_CHANNEL_3, dac.ANALOG_CHANNEL_4, dac.ANALOG_CHANNEL_5, dac.ANALOG_CHANNEL_6, dac.ANALOG_CHANNEL_7, dac.ANALOG_CHANNEL_8, dac.ANALOG_CHANNEL_9, dac.ANALOG_CHANNEL_10, dac.ANALOG_CHANNEL_11]
+    dac.configure_scanlist(scanlist)
+    dac.define_sampling_rate(40000)
+    dac.define_sample_points(20000)
+    for channel in scanlist:
+        dac.configure_output(channel, dac.VOLTAGE_RANGE_10V, dac.CHANNEL_UNIPOLAR_MODE)
+    dac.start_acquisition()
+
+    ranges, polarities = dac.scanlist_config()
+    metadata = {
+        'scanlist': scanlist,
+        'signal_names': signal_name,
+        'sampling_rate': dac.sampling_rate,
+        'sample_points': dac.sample_points,
+        'ranges': ranges,
+        'polarities': polarities,
+    }
+    server = BlockServer(metadata)
+    server.start()
+    print(f"Serving blocks on {server.address}")
+    try:
+        server.serve(dac)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        dac.stop_acquisition()
+        dac.close()
+        print(server.summary())
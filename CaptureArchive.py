@@ -0,0 +1,274 @@
+import io
+import json
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from KeysightDAC import KeysightDAC
+from CaptureFile import TimeSlicing, channel_scale_offset
+
+MAGIC = b'U2351ARC'
+CHUNK_HEADER = struct.Struct('<QI')  # first sample, sample count
+FOOTER = struct.Struct('<Q8s')  # index offset, magic
+
+def encode_column(codes, level):
+    # Delta encode with int16 wrap-around, then store the low bytes before the
+    # high bytes: slow PSU rails give runs of small deltas that zlib packs well
+    deltas = np.diff(codes, prepend=np.int16(0)).astype('<i2')
+    return zlib.compress(deltas.view(np.uint8).reshape(-1, 2).T.tobytes(), level)
+
+def decode_column(payload, sample_nbr):
+    shuffled = np.frombuffer(zlib.decompress(payload), dtype=np.uint8).reshape(2, sample_nbr)
+    deltas = np.ascontiguousarray(shuffled.T).view('<i2').ravel()
+    return np.cumsum(deltas, dtype=np.int16)
+
+def encode_chunk(first_sample, codes, level):
+    columns = [encode_column(codes[row], level) for row in range(codes.shape[0])]
+    sizes = struct.pack(f'<{len(columns)}I', *[len(column) for column in columns])
+    return CHUNK_HEADER.pack(first_sample, codes.shape[1]) + sizes + b''.join(columns)
+
+class ArchiveWriter:
+    """
+    Write a chunked, compressed, columnar archive of raw ADC codes.
+
+    The samples are cut in chunks of chunk_size samples; each channel of a
+    chunk is delta encoded and zlib compressed on its own. Chunks are
+    compressed by a thread pool (zlib releases the GIL) while the caller
+    keeps appending, and written in order. A JSON header keeps the scanlist,
+    names, ranges, polarities and the scale/offset turning a code into volts;
+    a chunk index at the end of the file allows random access.
+    """
+    def __init__(self, filename, scanlist, signal_names, ranges, polarities, sampling_rate, start_time=0.0, chunk_size=65536, level=6, workers=4):
+        self.channel_nbr = len(scanlist)
+        self.chunk_size = chunk_size
+        self.level = level
+        self.file = open(filename, 'wb')
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.pending = list()
+        self.max_pending = 2 * workers
+        self.chunk_index = list()  # [first sample, sample count, file offset]
+        self.buffer = np.empty((self.channel_nbr, chunk_size), dtype=np.int16)
+        self.buffered = 0
+        self.sample_nbr = 0
+
+        scale_offset = [channel_scale_offset(voltage_range, polarity) for voltage_range, polarity in zip(ranges, polarities)]
+        header = json.dumps({
+            'scanlist': list(scanlist),
+            'signal_names': list(signal_names),
+            'ranges': list(ranges),
+            'polarities': list(polarities),
+            'scales': [scale for scale, offset in scale_offset],
+            'offsets': [offset for scale, offset in scale_offset],
+            'sampling_rate': sampling_rate,
+            'start_time': start_time,
+            'chunk_size': chunk_size,
+        }).encode()
+        self.file.write(MAGIC + struct.pack('<I', len(header)) + header)
+
+    @classmethod
+    def for_daq(cls, daq, filename, signal_names=None, **kwargs):
+        if daq.block_period is None:
+            daq.update_block_timing()
+        if signal_names is None:
+            signal_names = [str(channel) for channel in daq.scanlist]
+        ranges, polarities = daq.scanlist_config()
+        return cls(filename, daq.scanlist, signal_names, ranges, polarities, daq.sampling_rate, **kwargs)
+
+    def write_block(self, raw_values):
+        offset, byte_nbr = KeysightDAC.parse_block_header(raw_values)
+        sample_nbr = byte_nbr // (2 * self.channel_nbr)
+        codes = np.frombuffer(raw_values, dtype='<i2', count=sample_nbr * self.channel_nbr, offset=offset)
+        self.write_codes(codes.reshape(sample_nbr, self.channel_nbr).T)
+
+    def write_codes(self, codes):
+        """Append a (channels, samples) int16 block."""
+        done = 0
+        while done < codes.shape[1]:
+            count = min(self.chunk_size - self.buffered, codes.shape[1] - done)
+            self.buffer[:, self.buffered:self.buffered + count] = codes[:, done:done + count]
+            self.buffered += count
+            done += count
+            if self.buffered == self.chunk_size:
+                self.flush_chunk()
+
+    def flush_chunk(self):
+        if self.buffered == 0:
+            return
+        codes = self.buffer[:, :self.buffered].copy()
+        self.pending.append((self.sample_nbr, self.buffered, self.pool.submit(encode_chunk, self.sample_nbr, codes, self.level)))
+        self.sample_nbr += self.buffered
+        self.buffered = 0
+        self.write_done(block=len(self.pending) >= self.max_pending)
+
+    def write_done(self, block=False):
+        # Chunks are written in order, as soon as the oldest one is compressed
+        while self.pending and (block or self.pending[0][2].done()):
+            first_sample, sample_nbr, future = self.pending.pop(0)
+            self.chunk_index.append([first_sample, sample_nbr, self.file.tell()])
+            self.file.write(future.result())
+            block = False
+
+    def close(self):
+        self.flush_chunk()
+        while self.pending:
+            self.write_done(block=True)
+        self.pool.shutdown()
+        index_offset = self.file.tell()
+        self.file.write(json.dumps(self.chunk_index).encode())
+        self.file.write(FOOTER.pack(index_offset, MAGIC))
+        self.file.close()
+
+class CaptureArchive(TimeSlicing):
+    """
+    Reader of an ArchiveWriter file.
+
+    Only the chunks overlapping the requested samples are decompressed; the
+    last decoded chunk is kept for sequential reads. Slicing with
+    archive[t0:t1, channels] and windows() work as on a CaptureFile.
+    """
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a capture archive")
+        header_size, = struct.unpack('<I', self.file.read(4))
+        self.metadata = json.loads(self.file.read(header_size))
+
+        self.file.seek(-FOOTER.size, io.SEEK_END)
+        index_offset, magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{filename} was not closed, its chunk index is missing")
+        footer_start = self.file.tell() - FOOTER.size
+        self.file.seek(index_offset)
+        self.chunk_index = json.loads(self.file.read(footer_start - index_offset))
+        self.chunk_starts = np.array([first_sample for first_sample, sample_nbr, offset in self.chunk_index], dtype=np.int64)
+
+        self.signal_names = self.metadata['signal_names']
+        self.sampling_rate = self.metadata['sampling_rate']
+        self.channels = self.metadata['scanlist']
+        self.channel_nbr = len(self.channels)
+        self.tables = [KeysightDAC.conversion_table(voltage_range, polarity, np.float32) for voltage_range, polarity in zip(self.metadata['ranges'], self.metadata['polarities'])]
+        self.cached_chunk = (None, None)
+
+    def __len__(self):
+        if not self.chunk_index:
+            return 0
+        first_sample, sample_nbr, offset = self.chunk_index[-1]
+        return first_sample + sample_nbr
+
+    def read_chunk(self, chunk, rows=None):
+        """
+        Decode the columns rows (every channel by default) of a chunk.
+
+        Returns a dict row -> int16 codes. Columns are compressed one by one,
+        so only the requested channels are decompressed.
+        """
+        rows = range(self.channel_nbr) if rows is None else rows
+        if self.cached_chunk[0] != chunk:
+            self.cached_chunk = (chunk, dict())
+        columns = self.cached_chunk[1]
+        missing = [row for row in rows if row not in columns]
+        if missing:
+            first_sample, sample_nbr, offset = self.chunk_index[chunk]
+            self.file.seek(offset + CHUNK_HEADER.size)
+            sizes = struct.unpack(f'<{self.channel_nbr}I', self.file.read(4 * self.channel_nbr))
+            column_offsets = offset + CHUNK_HEADER.size + 4 * self.channel_nbr + np.concatenate(([0], np.cumsum(sizes[:-1])))
+            for row in missing:
+                self.file.seek(int(column_offsets[row]))
+                columns[row] = decode_column(self.file.read(sizes[row]), sample_nbr)
+        return columns
+
+    def overlapping_chunks(self, start, stop):
+        """Yield (first_sample, sample_nbr, chunk) of the chunks holding samples of [start, stop)."""
+        for chunk in range(max(0, np.searchsorted(self.chunk_starts, start, 'right') - 1), len(self.chunk_index)):
+            first_sample, sample_nbr, offset = self.chunk_index[chunk]
+            if first_sample >= stop:
+                break
+            yield first_sample, sample_nbr, chunk
+
+    def codes(self, start=0, stop=None):
+        """Return samples [start, stop) as (channels, samples) int16 codes."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        out = np.empty((self.channel_nbr, max(0, stop - start)), dtype=np.int16)
+        for first_sample, sample_nbr, chunk in self.overlapping_chunks(start, stop):
+            low = max(start, first_sample)
+            high = min(stop, first_sample + sample_nbr)
+            columns = self.read_chunk(chunk)
+            for row in range(self.channel_nbr):
+                out[row, low - start:high - start] = columns[row][low - first_sample:high - first_sample]
+        return out
+
+    def volts(self, start=0, stop=None, channels=None, step=1):
+        """
+        Convert samples start, start + step, ... before stop of the given channels.
+
+        Chunks are read one at a time and only their stepped samples of the
+        requested channels are converted, so memory is bounded by one chunk
+        and the result whatever the length of [start, stop).
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        indexes = list(range(self.channel_nbr)) if channels is None else [self.channel_index(channel) for channel in channels]
+        values = np.empty((len(indexes), len(range(start, stop, step))), dtype=np.float32)
+        for first_sample, sample_nbr, chunk in self.overlapping_chunks(start, stop):
+            # First kept sample of the chunk, in phase with start
+            position = -(-(max(start, first_sample) - start) // step)
+            first = start + position * step
+            high = min(stop, first_sample + sample_nbr)
+            if first >= high:
+                continue
+            count = len(range(first, high, step))
+            columns = self.read_chunk(chunk, indexes)
+            for row, index in enumerate(indexes):
+                codes = columns[index][first - first_sample:high - first_sample:step].view(np.uint16)
+                np.take(self.tables[index], codes, out=values[row, position:position + count], mode='clip')
+        return values
+
+    def close(self):
+        self.file.close()
+
+def convert_csv(csv_filename, filename, ranges=KeysightDAC.VOLTAGE_RANGE_10V, polarities=KeysightDAC.CHANNEL_UNIPOLAR_MODE, signal_names=None, sampling_rate=None, lines_per_chunk=65536):
+    """
+    Ingest a data_export.csv file into an archive.
+
+    The file is read in bounded chunks; repeated header lines left by the old
+    export_to_csv are skipped. Volts are turned back into ADC codes with the
+    given ranges/polarities (one value or one per channel), which is exact for
+    values exported from the same settings. The sample rate is taken from the
+    time column when not given.
+    """
+    writer = None
+    with open(csv_filename) as csv_file:
+        header = csv_file.readline().strip().split(',')
+        lines = list()
+        for line in csv_file:
+            if line[:1].isdigit() or line[:1] == '-':
+                lines.append(line)
+            if len(lines) == lines_per_chunk:
+                writer = _write_csv_lines(writer, filename, header, lines, ranges, polarities, signal_names, sampling_rate)
+                lines = list()
+        if lines or writer is None:
+            writer = _write_csv_lines(writer, filename, header, lines, ranges, polarities, signal_names, sampling_rate)
+    writer.close()
+
+def _write_csv_lines(writer, filename, header, lines, ranges, polarities, signal_names, sampling_rate):
+    table = np.loadtxt(io.StringIO(''.join(lines)), delimiter=',', ndmin=2)
+    channel_nbr = table.shape[1] - 1 if table.size else len(header) - 1
+    if not isinstance(ranges, (list, tuple)):
+        ranges = [ranges] * channel_nbr
+    if not isinstance(polarities, (list, tuple)):
+        polarities = [polarities] * channel_nbr
+
+    if writer is None:
+        if signal_names is None:
+            names = header[1:]
+            signal_names = names if len(names) == channel_nbr and '...' not in names else [f'Channel {index + 1}' for index in range(channel_nbr)]
+        if sampling_rate is None:
+            sampling_rate = 1000 / (table[1, 0] - table[0, 0]) if len(table) > 1 else 0.0
+        writer = ArchiveWriter(filename, list(range(KeysightDAC.ANALOG_CHANNEL_1, KeysightDAC.ANALOG_CHANNEL_1 + channel_nbr)), signal_names, ranges, polarities, sampling_rate)
+
+    if table.size:
+        codes = np.empty((channel_nbr, table.shape[0]), dtype=np.int16)
+        for row in range(channel_nbr):
+            scale, offset = channel_scale_offset(ranges[row], polarities[row])
+            codes[row] = np.clip(np.round((table[:, row + 1] - offset) / scale), -32768, 32767)
+        writer.write_codes(codes)
+    return writer
@@ -0,0 +1,210 @@
+import os
+import time
+import numpy as np
+from KeysightDAC import KeysightDAC
+from RawRecorder import RawRecording
+
+MAGIC = b'U2351CAP'
+VERSION = 1
+HEADER_SIZE = 4096
+MAX_CHANNELS = 16
+
+# Fixed little-endian header, padded with zeros up to HEADER_SIZE. It is
+# followed by the interleaved (samples, channels) int16 ADC codes, volts being
+# code * scales[channel] + offsets[channel].
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('channel_nbr', '<u4'),
+    ('sampling_rate', '<f8'),
+    ('start_time', '<f8'),
+    ('channels', '<u2', (MAX_CHANNELS,)),
+    ('ranges', '<f8', (MAX_CHANNELS,)),
+    ('polarities', 'S4', (MAX_CHANNELS,)),
+    ('scales', '<f8', (MAX_CHANNELS,)),
+    ('offsets', '<f8', (MAX_CHANNELS,)),
+    ('names', 'S32', (MAX_CHANNELS,)),
+])
+
+def channel_scale_offset(voltage_range, polarity):
+    if polarity == KeysightDAC.CHANNEL_BIPOLAR_MODE:
+        return voltage_range / 32768, 0.0
+    return voltage_range / 65536, voltage_range / 2
+
+class CaptureWriter:
+    """
+    Write a capture file: fixed header then interleaved int16 codes.
+
+    Blocks are appended as they come from the instrument; a WAV:DATA? payload
+    already has the file layout so it is written without any conversion.
+    """
+    def __init__(self, filename, scanlist, signal_names, ranges, polarities, sampling_rate, start_time=None, buffer_size=1 << 22):
+        if len(scanlist) > MAX_CHANNELS:
+            raise ValueError(f"A capture holds at most {MAX_CHANNELS} channels")
+        self.filename = filename
+        self.channel_nbr = len(scanlist)
+        self.sample_nbr = 0
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['channel_nbr'] = self.channel_nbr
+        header['sampling_rate'] = sampling_rate
+        header['start_time'] = time.time() if start_time is None else start_time
+        for index, channel in enumerate(scanlist):
+            header['channels'][0, index] = channel
+            header['ranges'][0, index] = ranges[index]
+            header['polarities'][0, index] = polarities[index].encode()
+            header['scales'][0, index], header['offsets'][0, index] = channel_scale_offset(ranges[index], polarities[index])
+            header['names'][0, index] = signal_names[index].encode()[:32]
+
+        self.file = open(filename, 'wb', buffering=buffer_size)
+        self.file.write(header.tobytes().ljust(HEADER_SIZE, b'\0'))
+
+    @classmethod
+    def for_daq(cls, daq, filename, signal_names=None):
+        if daq.block_period is None:
+            daq.update_block_timing()
+        if signal_names is None:
+            signal_names = [str(channel) for channel in daq.scanlist]
+        ranges, polarities = daq.scanlist_config()
+        return cls(filename, daq.scanlist, signal_names, ranges, polarities, daq.sampling_rate)
+
+    def write_block(self, raw_values):
+        offset, byte_nbr = KeysightDAC.parse_block_header(raw_values)
+        byte_nbr -= byte_nbr % (2 * self.channel_nbr)
+        self.file.write(memoryview(raw_values)[offset:offset + byte_nbr])
+        self.sample_nbr += byte_nbr // (2 * self.channel_nbr)
+
+    def write_codes(self, codes):
+        """Append a (channels, samples) block of int16 codes."""
+        self.file.write(np.ascontiguousarray(codes.T, dtype='<i2'))
+        self.sample_nbr += codes.shape[1]
+
+    def close(self):
+        self.file.close()
+
+class TimeSlicing:
+    """
+    Time and channel slicing shared by the capture readers.
+
+    capture[t0:t1, ["3V3", "1V8"]] converts the samples between t0 and t1
+    seconds from the capture start; a step (seconds) decimates. Channels are
+    given as positions, signal names or channel numbers; a single channel
+    gives a 1-D array. windows() walks a capture in fixed-size windows with
+    bounded memory. Subclasses provide volts(start, stop, channels, step)
+    and codes(start, stop), the raw samples [start, stop) as a (channels,
+    samples) int16 array.
+    """
+    def channel_index(self, channel):
+        """Accept a position in the scanlist, a signal name or a channel number."""
+        if isinstance(channel, str):
+            return self.signal_names.index(channel)
+        if channel in self.channels:
+            return self.channels.index(channel)
+        return channel
+
+    def duration(self):
+        return len(self) / self.sampling_rate
+
+    def sample_index(self, t):
+        # Rounded first: 1.1 * 45000 is 49500.000000000007, the ceiling would skip a sample
+        return min(len(self), max(0, int(np.ceil(round(t * self.sampling_rate, 6)))))
+
+    def sample_range(self, t0=None, t1=None):
+        start = 0 if t0 is None else self.sample_index(t0)
+        stop = len(self) if t1 is None else self.sample_index(t1)
+        return start, max(start, stop)
+
+    def time_slice(self, t0, t1, channels=None):
+        """Convert the samples between t0 and t1 seconds from the capture start."""
+        return self.volts(*self.sample_range(t0, t1), channels)
+
+    def __getitem__(self, key):
+        time_key, channel_key = key if isinstance(key, tuple) else (key, None)
+        single = isinstance(channel_key, (str, int))
+        channels = [channel_key] if single else channel_key
+
+        if isinstance(time_key, slice):
+            step = 1 if time_key.step is None else max(1, int(round(time_key.step * self.sampling_rate)))
+            values = self.volts(*self.sample_range(time_key.start, time_key.stop), channels, step)
+        else:
+            start = self.sample_index(time_key)
+            if start >= len(self):
+                raise IndexError(f"{time_key} s is past the end of the capture")
+            values = self.volts(start, start + 1, channels)[:, 0]
+        return values[0] if single else values
+
+    def windows(self, window, channels=None, step=None):
+        """
+        Yield (t0, values) for consecutive windows of window seconds.
+
+        step (seconds, default window) sets the distance between window starts,
+        a smaller step gives overlapping windows. The last window may be short.
+        """
+        size = max(1, int(round(window * self.sampling_rate)))
+        stride = size if step is None else max(1, int(round(step * self.sampling_rate)))
+        for start in range(0, len(self), stride):
+            yield start / self.sampling_rate, self.volts(start, min(len(self), start + size), channels)
+
+class CaptureFile(TimeSlicing):
+    """
+    Memory-mapped reader of a capture file.
+
+    Opening only reads the header; samples are paged in by the OS when a
+    time/channel range is converted with volts(), time_slice() or
+    capture[t0:t1, channels], so captures larger than the RAM can be sliced.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.header = np.fromfile(filename, dtype=HEADER_DTYPE, count=1)[0]
+        if self.header['magic'] != MAGIC:
+            raise ValueError(f"{filename} is not a capture file")
+
+        self.channel_nbr = int(self.header['channel_nbr'])
+        self.sampling_rate = float(self.header['sampling_rate'])
+        self.start_time = float(self.header['start_time'])
+        self.channels = [int(channel) for channel in self.header['channels'][:self.channel_nbr]]
+        self.ranges = [float(voltage_range) for voltage_range in self.header['ranges'][:self.channel_nbr]]
+        self.polarities = [polarity.decode() for polarity in self.header['polarities'][:self.channel_nbr]]
+        self.signal_names = [name.decode() for name in self.header['names'][:self.channel_nbr]]
+        self.tables = [KeysightDAC.conversion_table(voltage_range, polarity, np.float32) for voltage_range, polarity in zip(self.ranges, self.polarities)]
+
+        # The sample count comes from the file size so an unfinished capture stays readable
+        if os.path.getsize(filename) <= HEADER_SIZE:
+            data = np.zeros(0, dtype='<i2')
+        else:
+            data = np.memmap(filename, dtype='<i2', mode='r', offset=HEADER_SIZE)
+        self.data = data[:len(data) // self.channel_nbr * self.channel_nbr].reshape(-1, self.channel_nbr)
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def codes(self, start=0, stop=None):
+        """Return samples [start, stop) as (channels, samples) int16 codes, a view of the file."""
+        return self.data[start:stop].T
+
+    def volts(self, start=0, stop=None, channels=None, step=1):
+        """Convert samples [start, stop) of the given channels to a (channels, samples) float32 array."""
+        indexes = range(self.channel_nbr) if channels is None else [self.channel_index(channel) for channel in channels]
+        codes = self.data[start:stop:step].view(np.uint16)
+        values = np.empty((len(indexes), codes.shape[0]), dtype=np.float32)
+        for row, index in enumerate(indexes):
+            np.take(self.tables[index], codes[:, index], out=values[row], mode='clip')
+        return values
+
+    def times(self, start=0, stop=None):
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return np.arange(start, stop) / self.sampling_rate
+
+def convert_raw_recording(raw_filename, filename, signal_names=None):
+    """Turn a RawRecorder capture into a single capture file."""
+    recording = RawRecording(raw_filename)
+    metadata = recording.metadata
+    if signal_names is None:
+        signal_names = [str(channel) for channel in metadata['scanlist']]
+    writer = CaptureWriter(filename, metadata['scanlist'], signal_names, metadata['ranges'], metadata['polarities'], metadata['sampling_rate'], metadata['start_time'])
+    chunk = 1 << 20
+    for start in range(0, len(recording), chunk):
+        writer.write_codes(recording.codes[start:start + chunk].T)
+    writer.close()
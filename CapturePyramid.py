@@ -0,0 +1,200 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+from KeysightDAC import KeysightDAC
+
+MAGIC = b'U2351LOD'
+
+def envelope(codes, factor):
+    """Reduce (channels, samples) codes to (channels, samples // factor, 2) min/max bins."""
+    bins = codes.reshape(codes.shape[0], -1, factor)
+    return np.stack((bins.min(axis=2), bins.max(axis=2)), axis=2)
+
+def merge_pairs(bins):
+    """Merge consecutive pairs of (channels, bins, 2) min/max bins."""
+    pairs = bins.reshape(bins.shape[0], -1, 2, 2)
+    return np.stack((pairs[:, :, :, 0].min(axis=2), pairs[:, :, :, 1].max(axis=2)), axis=2)
+
+class PyramidBuilder:
+    """
+    Build min/max envelopes of the ADC codes at power-of-two decimations.
+
+    Level 0 keeps the min and max of every min_factor samples, each next level
+    merges two bins of the previous one. Samples can be appended block by
+    block during an acquisition or in chunks over a stored capture; only the
+    bins not yet paired are kept aside, so the cost is linear. The pyramid
+    takes about 4 / min_factor of the capture size: completed bins are
+    streamed to one temporary file per level (in directory) and only
+    gathered into the pyramid file by save(), so the memory used stays
+    bounded whatever the capture length.
+    """
+    def __init__(self, channel_nbr, sampling_rate, min_factor=16, max_levels=32, directory=None):
+        self.channel_nbr = channel_nbr
+        self.sampling_rate = sampling_rate
+        self.min_factor = min_factor
+        self.max_levels = max_levels
+        self.directory = directory
+        self.level_files = [None] * max_levels
+        self.bin_nbr = [0] * max_levels
+        self.pending = [np.empty((channel_nbr, 0), dtype=np.int16)] + [np.empty((channel_nbr, 0, 2), dtype=np.int16) for _ in range(max_levels - 1)]
+        self.sample_nbr = 0
+
+    def write_block(self, raw_values):
+        offset, byte_nbr = KeysightDAC.parse_block_header(raw_values)
+        sample_nbr = byte_nbr // (2 * self.channel_nbr)
+        codes = np.frombuffer(raw_values, dtype='<i2', count=sample_nbr * self.channel_nbr, offset=offset)
+        self.write_codes(codes.reshape(sample_nbr, self.channel_nbr).T)
+
+    def write_codes(self, codes):
+        """Append a (channels, samples) block of int16 codes."""
+        self.sample_nbr += codes.shape[1]
+        codes = np.concatenate((self.pending[0], codes), axis=1)
+        complete = codes.shape[1] // self.min_factor * self.min_factor
+        self.pending[0] = codes[:, complete:].copy()
+        if complete:
+            self.push(0, envelope(codes[:, :complete], self.min_factor))
+
+    def push(self, level, bins):
+        if self.level_files[level] is None:
+            self.level_files[level] = tempfile.TemporaryFile(dir=self.directory)
+        # Stored as (bins, channels, 2) so a time range of every channel is contiguous
+        self.level_files[level].write(np.ascontiguousarray(bins.transpose(1, 0, 2), dtype='<i2').tobytes())
+        self.bin_nbr[level] += bins.shape[1]
+        if level + 1 == self.max_levels:
+            return
+        bins = np.concatenate((self.pending[level + 1], bins), axis=1)
+        complete = bins.shape[1] // 2 * 2
+        self.pending[level + 1] = bins[:, complete:].copy()
+        if complete:
+            self.push(level + 1, merge_pairs(bins[:, :complete]))
+
+    def finish(self):
+        """Close the partial bins and return the number of levels kept."""
+        if self.pending[0].shape[1]:
+            self.push(0, np.stack((self.pending[0].min(axis=1), self.pending[0].max(axis=1)), axis=1)[:, None, :])
+            self.pending[0] = self.pending[0][:, :0]
+        for level in range(self.max_levels):
+            if level + 1 < self.max_levels and self.pending[level + 1].shape[1]:
+                # An unpaired last bin of this level makes the last bin of the next
+                last = self.pending[level + 1]
+                self.pending[level + 1] = last[:, :0]
+                self.push(level + 1, last)
+            if self.bin_nbr[level] <= 1:
+                return level + 1
+        return self.max_levels
+
+    def save(self, filename):
+        level_nbr = self.finish()
+        header = {
+            'sampling_rate': self.sampling_rate,
+            'sample_nbr': self.sample_nbr,
+            'channel_nbr': self.channel_nbr,
+            'levels': list(),
+        }
+        offset = 0
+        for level in range(level_nbr):
+            header['levels'].append([self.min_factor << level, self.bin_nbr[level], offset])
+            offset += self.bin_nbr[level] * self.channel_nbr * 2 * 2
+        header = json.dumps(header).encode()
+        with open(filename, 'wb') as f:
+            f.write(MAGIC + struct.pack('<I', len(header)) + header)
+            for level in range(level_nbr):
+                if self.level_files[level] is not None:
+                    self.level_files[level].seek(0)
+                    shutil.copyfileobj(self.level_files[level], f, 1 << 20)
+        self.close()
+
+    def close(self):
+        """Delete the temporary level files."""
+        for level_file in self.level_files:
+            if level_file is not None:
+                level_file.close()
+        self.level_files = [None] * self.max_levels
+
+def build_pyramid(capture, filename, chunk=1 << 20, min_factor=16):
+    """Build and save the pyramid of a CaptureFile or CaptureArchive in one pass."""
+    # The level files can be large: keep them on the disk of the pyramid, not in /tmp
+    builder = PyramidBuilder(capture.channel_nbr, capture.sampling_rate, min_factor, directory=os.path.dirname(os.path.abspath(filename)))
+    try:
+        for start in range(0, len(capture), chunk):
+            stop = min(len(capture), start + chunk)
+            builder.write_codes(capture.codes(start, stop))
+        builder.save(filename)
+    finally:
+        builder.close()
+
+class CapturePyramid:
+    """
+    Memory-mapped min/max pyramid of a capture, for zooming at any scale.
+
+    envelope() picks the coarsest level that still gives at least one bin per
+    pixel, so a window is fetched in O(pixels) whatever its length. A glitch
+    of a single sample stays in the min or max of its bin at every level.
+    Below the finest level the samples are read from the capture itself.
+    """
+    def __init__(self, capture, filename):
+        self.capture = capture
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{filename} is not a capture pyramid")
+            header_size, = struct.unpack('<I', f.read(4))
+            self.header = json.loads(f.read(header_size))
+        data_offset = len(MAGIC) + 4 + header_size
+
+        self.sampling_rate = self.header['sampling_rate']
+        self.sample_nbr = self.header['sample_nbr']
+        channel_nbr = self.header['channel_nbr']
+        self.factors = list()
+        self.levels = list()
+        for factor, bin_nbr, offset in self.header['levels']:
+            self.factors.append(factor)
+            if bin_nbr:
+                self.levels.append(np.memmap(filename, dtype='<i2', mode='r', offset=data_offset + offset, shape=(bin_nbr, channel_nbr, 2)))
+            else:
+                self.levels.append(np.zeros((0, channel_nbr, 2), dtype='<i2'))
+
+    def envelope(self, t0, t1, pixels, channels=None):
+        """
+        Return (times, mins, maxs) of the samples between t0 and t1 seconds.
+
+        times are the start of each bin in seconds, mins and maxs are
+        (channels, bins) float32 volts with at least pixels bins when the
+        window holds that many samples.
+        """
+        indexes = list(range(self.levels[0].shape[1])) if channels is None else [self.capture.channel_index(channel) for channel in channels]
+        # Rounded first so float noise around a sample time doesn't move the bounds by one
+        start = min(self.sample_nbr, max(0, int(np.floor(round(t0 * self.sampling_rate, 6)))))
+        stop = min(self.sample_nbr, max(start, int(np.ceil(round(t1 * self.sampling_rate, 6)))))
+        samples_per_pixel = (stop - start) / max(1, pixels)
+
+        level = None
+        for index, factor in enumerate(self.factors):
+            if factor <= samples_per_pixel:
+                level = index
+        if level is None:
+            values = self.capture.volts(start, stop, indexes)
+            return np.arange(start, stop) / self.sampling_rate, values, values
+
+        factor = self.factors[level]
+        first = start // factor
+        last = -(-stop // factor)
+        bins = self.levels[level][first:last]
+        mins = np.empty((len(indexes), bins.shape[0]), dtype=np.float32)
+        maxs = np.empty((len(indexes), bins.shape[0]), dtype=np.float32)
+        for row, index in enumerate(indexes):
+            np.take(self.capture.tables[index], bins[:, index, 0].view(np.uint16), out=mins[row], mode='clip')
+            np.take(self.capture.tables[index], bins[:, index, 1].view(np.uint16), out=maxs[row], mode='clip')
+        return np.arange(first, first + bins.shape[0]) * factor / self.sampling_rate, mins, maxs
+
+if __name__ == "__main__":
+    import sys
+    from CaptureFile import CaptureFile
+
+    # Build the pyramid of a capture file next to it: capture.u2cap -> capture.u2cap.lod
+    capture = CaptureFile(sys.argv[1])
+    build_pyramid(capture, sys.argv[1] + '.lod')
+    pyramid = CapturePyramid(capture, sys.argv[1] + '.lod')
+    print(f"{len(pyramid.levels)} levels, decimation {pyramid.factors[0]} to {pyramid.factors[-1]}")
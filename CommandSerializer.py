@@ -0,0 +1,91 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from DataAcquisition import LatencyHistogram
+
+class RequestHistogram(LatencyHistogram):
+    """LatencyHistogram with bins fine enough for single USB requests."""
+    EDGES = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+class CommandSerializer:
+    """
+    Give the threads sharing one instrument session their turn, one request at a time.
+
+    A request is a whole transaction (a write, a query, or a write and the
+    read of its response) run with transaction(); no other thread touches the
+    session until it is over, so a STOP sent from the GUI can't land between
+    WAV:DATA? and the read of the block. When the session is released, the
+    waiting requests are granted by priority, CONTROL before POLLING, then in
+    arrival order. A thread already holding the session may nest transactions.
+
+    The wait for the session and the total time of every request are kept per
+    command in histograms, see summary().
+    """
+    CONTROL = 0
+    POLLING = 1
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.owner = None
+        self.depth = 0
+        self.waiting = list()  # heap of (priority, ticket) of the requests waiting
+        self.tickets = itertools.count()
+        self.requests = dict()  # command -> (priority, wait histogram, total histogram)
+
+    def acquire(self, priority):
+        me = threading.get_ident()
+        with self.condition:
+            if self.owner == me:
+                self.depth += 1
+                return
+            request = (priority, next(self.tickets))
+            heapq.heappush(self.waiting, request)
+            while self.owner is not None or self.waiting[0] != request:
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.owner = me
+            self.depth = 1
+
+    def release(self):
+        with self.condition:
+            self.depth -= 1
+            if self.depth == 0:
+                self.owner = None
+                self.condition.notify_all()
+
+    @contextmanager
+    def transaction(self, command, priority=POLLING):
+        """Hold the session for one request; command names it in the statistics."""
+        nested = self.owner == threading.get_ident()
+        start = time.monotonic()
+        self.acquire(priority)
+        granted = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release()
+            if not nested:
+                self.record(command, priority, granted - start, time.monotonic() - start)
+
+    def record(self, command, priority, wait, total):
+        # Arguments are dropped so that e.g. every ROUT:CHAN:RANG? shares a line
+        name = command.split(' ', 1)[0]
+        with self.condition:
+            if name not in self.requests:
+                self.requests[name] = (priority, RequestHistogram(), RequestHistogram())
+            _, wait_histogram, total_histogram = self.requests[name]
+            wait_histogram.add(wait)
+            total_histogram.add(total)
+
+    def summary(self):
+        with self.condition:
+            return {
+                name: {
+                    'priority': 'control' if priority == self.CONTROL else 'polling',
+                    'wait': wait_histogram.summary(),
+                    'total': total_histogram.summary(),
+                }
+                for name, (priority, wait_histogram, total_histogram) in self.requests.items()
+            }
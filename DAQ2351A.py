@@ -1,165 +1,6 @@
-# import pyvisa
 import time
-import numpy as np
 import matplotlib.pyplot as plt
-
-class KeysightDAC:
-    ANALOG_CHANNEL_1    = 101
-    ANALOG_CHANNEL_2    = 102
-    ANALOG_CHANNEL_3    = 103
-    ANALOG_CHANNEL_4    = 104
-    ANALOG_CHANNEL_5    = 105
-    ANALOG_CHANNEL_6    = 106
-    ANALOG_CHANNEL_7    = 107
-    ANALOG_CHANNEL_8    = 108
-    ANALOG_CHANNEL_9    = 109
-    ANALOG_CHANNEL_10   = 110
-    ANALOG_CHANNEL_11   = 111
-    ANALOG_CHANNEL_12   = 112
-    ANALOG_CHANNEL_13   = 113
-    ANALOG_CHANNEL_14   = 114
-    ANALOG_CHANNEL_15   = 115
-    ANALOG_CHANNEL_16   = 116
-    
-    VOLTAGE_RANGE_10V   = 10
-    VOLTAGE_RANGE_5V    = 5
-    VOLTAGE_RANGE_2V5   = 2.5
-    VOLTAGE_RANGE_1V25  = 1.25
-    
-    CHANNEL_UNIPOLAR_MODE   = 'UNIP'
-    CHANNEL_BIPOLAR_MODE    = 'BIP'
-    
-    def __init__(self, usb_address):
-        self.usb_address = usb_address
-        self.resource_manager = pyvisa.ResourceManager()
-        self.instrument = None
-        self.scanlist = None
-
-    def connect(self):
-        self.instrument = self.resource_manager.open_resource(self.usb_address)
-        # print(f"Connected to: {self.instrument.query('*IDN?')}")
-
-    def send_command(self, command):
-        self.instrument.write(command)
-
-    def query(self, command):
-        return self.instrument.query(command)
-    
-    def read_raw(self):
-        return self.instrument.read_raw()
-
-    def configure_output(self, channel, voltage_range, polarity):
-        self.send_command(f'ROUT:CHAN:RANG {voltage_range}, (@{channel})')
-        self.send_command(f'ROUT:CHAN:POL {polarity}, (@{channel})')
-        
-    def get_voltage_range(self, channel):
-        return int(self.query(f"ROUT:CHAN:RANG? (@{channel})"))
-        
-    def configure_scanlist(self, channels):
-        self.scanlist = list()
-        command = 'ROUT:SCAN (@'
-        print(type(channels))
-        
-        if type(channels) is int:
-            command = command + '{}'.format(channels)
-            command = command + ')'
-        else:
-            for a_channel in channels:
-                command = command + '{},'.format(a_channel)
-                self.scanlist.append(a_channel)
-            command = command[:-1] + ')'
-        print(command)
-        self.send_command(command)
-
-    def measure_output(self, channel):
-        return float(self.query(f'MEAS? (@{channel})'))
-
-    def get_sampling_rate(self):
-        return self.query("ACQuire:SRATe?")
-
-    def define_sampling_rate(self, rate):
-        self.send_command("ACQuire:SRATe {}".format(rate)) # rate shall be in Hertz
-        
-    def get_sampling_points(self):
-        return self.query("WAV:POIN?")
-    
-    def define_sample_points(self, number_of_points):
-        self.send_command("WAV:POIN {}".format(number_of_points))
-        target = self.get_sampling_points()
-        
-        if int(target) != number_of_points:
-            print("Can't define the wanted number of points")
-
-    def close(self):
-        if self.instrument:
-            self.instrument.close()
-            
-    def convert_raw_values(self, raw_values, scale):
-        byte_nbr = int(raw_values[2:10].decode())  # Get the number of bytes
-        # print(raw_values)
-        index = 10  # Start the index at 10
-        channel_nbr = len(self.scanlist)
-        print(raw_values)
-        
-        if channel_nbr == 1:
-            decimal_values = [] # Initialize an empty list to store the decimal values
-            while index < 10 + byte_nbr:
-                # Combine the two bytes, reversing their order
-                combined_value = (raw_values[index + 1] << 8) | raw_values[index]
-                
-                # Check the sign bit (most significant bit)
-                if combined_value & 0x8000 == 0:
-                    # Positive value
-                    decimal_value = ((combined_value / 65536) + 0.5) * scale
-                else:
-                    # Negative value, use only the lower 15 bits
-                    decimal_value = ((combined_value & 0x7FFF) / 65536) * scale
-                    
-                decimal_values.append(decimal_value)  # Store the decimal value in the list
-                
-                index += 2
-                
-            return np.array(decimal_values)  # Convert the list to a NumPy array and return it
-        
-        else:
-            decimal_values = [] # Initialize an empty list to store the decimal values
-            channel_index = 0
-            init_index = 0
-            
-            # Create a list for each channel scanned
-            while init_index != channel_nbr:
-                decimal_values.append([])
-                init_index += 1
-                
-            while index < 10 + byte_nbr:
-                # Create n list to store the values
-                # address the first value to the first channel on the scanlist
-                
-                
-                # Combine the two bytes, reversing their order
-                combined_value = (raw_values[index + 1] << 8) | raw_values[index]
-                
-                # Check the sign bit (most significant bit)
-                if combined_value & 0x8000 == 0:
-                    # Positive value
-                    decimal_value = ((combined_value / 65536) + 0.5) * scale
-                else:
-                    # Negative value, use only the lower 15 bits
-                    decimal_value = ((combined_value & 0x7FFF) / 65536) * scale
-                    
-                decimal_values[channel_index].append(decimal_value)  # Store the decimal value in the list
-                # print(channel_index)
-                # print(channel_nbr)
-                if channel_index + 1 == channel_nbr:
-                    channel_index = 0
-                else:
-                    channel_index += 1
-                
-                
-                index += 2
-                
-            return np.array(decimal_values)  # Convert the list to a NumPy array and return it
-        
+from KeysightDAC import KeysightDAC
 
 if __name__ == "__main__":
     usb_address = "USB0::0x0957::0x1118::TW47031015::0::INSTR"  # Remplacez par l'adresse USB réelle de votre DAC
@@ -199,8 +40,7 @@ if __name__ == "__main__":
         # scale = int(dac.query('ROUT:CHAN:RANG? (@101)'))
         # print(scale)
         time.sleep(0.5)
-        dac.send_command('RUN')
-        status = dac.query('WAV:STAT?')
+        dac.start_acquisition()
         
         
         # if "EPTY" in status:
@@ -224,18 +64,16 @@ if __name__ == "__main__":
         # print(end)
         try:
             next_frame = time.time()
-            status = dac.query('WAV:STAT?')
-            while "DATA" not in status:
-                status = dac.query('WAV:STAT?')
+            dac.wait_for_data()
                 
             now = time.time()
-            dac.send_command('WAV:DATA?')
-            result = dac.read_raw()
-            values = dac.convert_raw_values(result, dac.get_voltage_range(dac.ANALOG_CHANNEL_1))
+            result = dac.fetch_block()
+            values = dac.convert_raw_values(result)
             print()
             end = time.time() - now
             print(values.size)
             print(time.time() - next_frame)
+            print(f"{dac.poll_count} WAV:STAT? polls")
             print(end)  
             
               # Plot the values
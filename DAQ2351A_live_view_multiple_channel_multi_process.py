@@ -0,0 +1,96 @@
+import matplotlib.pyplot as plt
+from matplotlib.widgets import Button
+from KeysightDAC import KeysightDAC
+from AcquisitionProcess import AcquisitionProcess
+from LivePlot import PlotBuffer, RenderScheduler
+
+buffer_size = 200000
+
+def update_plot(frame, plot_buffer, lines, engine):
+    # Drain the blocks published by the acquisition process, they keep coming
+    # while paused and go to the history behind the frozen window
+    for sequence, host_time, values in engine.blocks():
+        plot_buffer.append(values, host_time)
+
+    # Render once per tick, and only when the displayed window changed
+    if not plot_buffer.update_lines(lines):
+        return lines
+
+    ax.relim()
+    ax.autoscale_view()
+    frame.canvas.draw()
+    frame.canvas.flush_events()
+    return lines
+
+def on_pause(event):
+    if plot_buffer.state == plot_buffer.LIVE:
+        plot_buffer.freeze()
+        pause_button.label.set_text('Resume')
+    else:
+        plot_buffer.resume()
+        pause_button.label.set_text('Pause')
+
+def on_key(event):
+    # While paused, [ and ] browse the history by half a window (the arrows belong to the toolbar)
+    if event.key == '[':
+        plot_buffer.scroll(-plot_buffer.buffer_size // 2)
+    elif event.key == ']':
+        plot_buffer.scroll(plot_buffer.buffer_size // 2)
+
+signal_name = ["5V", "3V3", "2V7", "1V8", "1V2", "1V2_S", "VUSB_S", "1V2_CAM", "1V8_CAM", "3V3_PDCD", "VUSB"]
+
+if __name__ == "__main__":
+    usb_address = "USB0::0x0957::0x1118::TW47031015::0::INSTR"  # Replace with actual USB address
+    lines = []
+
+    scanlist = [KeysightDAC.ANALOG_CHANNEL_1, KeysightDAC.ANALOG_CHANNEL_2, KeysightDAC.ANALOG_CHANNEL_3, KeysightDAC.ANALOG_CHANNEL_4, KeysightDAC.ANALOG_CHANNEL_5, KeysightDAC.ANALOG_CHANNEL_6, KeysightDAC.ANALOG_CHANNEL_7, KeysightDAC.ANALOG_CHANNEL_8, KeysightDAC.ANALOG_CHANNEL_9, KeysightDAC.ANALOG_CHANNEL_10, KeysightDAC.ANALOG_CHANNEL_11]
+    channel_config = {channel: (KeysightDAC.VOLTAGE_RANGE_10V, KeysightDAC.CHANNEL_UNIPOLAR_MODE) for channel in scanlist}
+
+    # The USB session is owned by the acquisition process, this one only renders
+    engine = AcquisitionProcess(usb_address, scanlist, channel_config, 40000, 20000)  # Max with 10 channels
+    engine.start()
+    try:
+        if not engine.wait_ready(timeout=10.0):
+            raise RuntimeError("Acquisition process not ready after 10 s")
+    except RuntimeError:
+        engine.stop()
+        raise
+    sampling_rate = engine.get_sampling_rate()
+
+    fig, ax = plt.subplots()
+
+    for idx, channel in enumerate(scanlist):
+        line, = ax.plot([], [], lw=1, label=f"{signal_name[idx]}")
+        lines.append(line)
+    plot_buffer = PlotBuffer(len(scanlist), buffer_size, sampling_rate, history_size=10 * buffer_size)
+
+    ax.grid()
+    ax.set(xlim=(0, (buffer_size / sampling_rate) * 1000))
+    ax.legend(loc='upper right')
+
+    # Add the pause button
+    ax_pause = plt.axes([0.81, 0.01, 0.05, 0.025])
+    pause_button = Button(ax_pause, 'Pause')
+    pause_button.on_clicked(on_pause)
+    fig.canvas.mpl_connect('key_press_event', on_key)
+
+    plt.ion()
+    plt.show()
+
+    scheduler = RenderScheduler(target_fps=30)
+    status = fig.text(0.01, 0.01, '', fontsize=8)
+
+    try:
+        while plt.fignum_exists(fig.number):
+            render_start = scheduler.wait(fig.canvas)
+            lines = update_plot(fig, plot_buffer, lines, engine)
+            if plot_buffer.drawn_time is not None:
+                scheduler.record(render_start, plot_buffer.drawn_time)
+                plot_buffer.drawn_time = None
+            status.set_text(scheduler.status_text())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(engine.summary())
+        print(scheduler.summary())
+        engine.stop()
@@ -1,220 +1,50 @@
-import pyvisa
 import time
-import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button
-import threading
-import queue
+from KeysightDAC import KeysightDAC
+from DataAcquisition import BlockRing, BlockQueue, DataAcquisitionThread
+from LivePlot import PlotBuffer, RenderScheduler, BlitRenderer
 # import matplotlib.style as mplstyle
 
 # mplstyle.use(['dark_background', 'ggplot', 'fast'])
 
-class KeysightDAC:
-    ANALOG_CHANNEL_1 = 101
-    ANALOG_CHANNEL_2 = 102
-    ANALOG_CHANNEL_3 = 103
-    ANALOG_CHANNEL_4 = 104
-    ANALOG_CHANNEL_5 = 105
-    ANALOG_CHANNEL_6 = 106
-    ANALOG_CHANNEL_7 = 107
-    ANALOG_CHANNEL_8 = 108
-    ANALOG_CHANNEL_9 = 109
-    ANALOG_CHANNEL_10 = 110
-    ANALOG_CHANNEL_11 = 111
-    ANALOG_CHANNEL_12 = 112
-    ANALOG_CHANNEL_13 = 113
-    ANALOG_CHANNEL_14 = 114
-    ANALOG_CHANNEL_15 = 115
-    ANALOG_CHANNEL_16 = 116
-    
-    VOLTAGE_RANGE_10V = 10
-    VOLTAGE_RANGE_5V = 5
-    VOLTAGE_RANGE_2V5 = 2.5
-    VOLTAGE_RANGE_1V25 = 1.25
-    
-    CHANNEL_UNIPOLAR_MODE = 'UNIP'
-    CHANNEL_BIPOLAR_MODE = 'BIP'
-
-    def __init__(self, usb_address):
-        self.usb_address = usb_address
-        self.resource_manager = pyvisa.ResourceManager()
-        self.instrument = None
-        self.scanlist = None
-
-    def connect(self):
-        try:
-            self.instrument = self.resource_manager.open_resource(self.usb_address)
-        except Exception as e:
-            print(f"Failed to connect to the instrument: {e}")
-
-    def send_command(self, command):
-        self.instrument.write(command)
-
-    def query(self, command):
-        try:
-            return self.instrument.query(command)
-        except Exception as e:
-            print(f"Failed to query the instrument: {e}")
-            return ""
-
-    def read_raw(self):
-        return self.instrument.read_raw()
-
-    def configure_output(self, channel, voltage_range, polarity):
-        self.send_command(f'ROUT:CHAN:RANG {voltage_range}, (@{channel})')
-        self.send_command(f'ROUT:CHAN:POL {polarity}, (@{channel})')
-        
-    def get_voltage_range(self, channel):
-        return int(self.query(f"ROUT:CHAN:RANG? (@{channel})"))
-        
-    def configure_scanlist(self, channels):
-        self.scanlist = list()
-        command = 'ROUT:SCAN (@'
-        
-        if isinstance(channels, int):
-            command += f'{channels})'
-        else:
-            for a_channel in channels:
-                command += f'{a_channel},'
-                self.scanlist.append(a_channel)
-            command = command[:-1] + ')'
-            
-        self.send_command(command)
-
-    def measure_output(self, channel):
-        return float(self.query(f'MEAS? (@{channel})'))
+buffer_size = 40000
 
-    def get_sampling_rate(self):
-        return float(self.query("ACQuire:SRATe?"))
-
-    def define_sampling_rate(self, rate):
-        self.send_command(f"ACQuire:SRATe {rate}") # rate shall be in Hertz
-        
-    def get_sampling_points(self):
-        return self.query("WAV:POIN?")
-    
-    def define_sample_points(self, number_of_points):
-        self.send_command(f"WAV:POIN {number_of_points}")
-        target = self.get_sampling_points()
-        
-        if int(target) != number_of_points:
-            print("Can't define the wanted number of points")
-
-    def close(self):
-        if self.instrument:
-            self.instrument.close()
-            
-    def convert_raw_values(self, raw_values, scale):
-        byte_nbr = int(raw_values[2:10].decode())  # Get the number of bytes
-        index = 10  # Start the index at 10
-        channel_nbr = len(self.scanlist)
-
-        if channel_nbr == 1:
-            decimal_values = []
-            while index + 1 < 10 + byte_nbr:
-                combined_value = (raw_values[index + 1] << 8) | raw_values[index]
-                if combined_value & 0x8000 == 0:
-                    decimal_value = ((combined_value / 65536) + 0.5) * scale
-                else:
-                    decimal_value = ((combined_value & 0x7FFF) / 65536) * scale
-                decimal_values.append(decimal_value)
-                index += 2
-            return np.array(decimal_values)
-        
-        else:
-            decimal_values = [[] for _ in range(channel_nbr)]
-            channel_index = 0
-            while index + 1 < 10 + byte_nbr:
-                combined_value = (raw_values[index + 1] << 8) | raw_values[index]
-                if combined_value & 0x8000 == 0:
-                    decimal_value = ((combined_value / 65536) + 0.5) * scale
-                else:
-                    decimal_value = ((combined_value & 0x7FFF) / 65536) * scale
-                decimal_values[channel_index].append(decimal_value)
-                channel_index = (channel_index + 1) % channel_nbr
-                index += 2
-            return [np.array(vals) for vals in decimal_values]
-
-class DataAcquisitionThread(threading.Thread):
-    def __init__(self, daq, data_queue, scanlist, scale):
-        super().__init__()
-        self.daq = daq
-        self.data_queue = data_queue
-        self.scanlist = scanlist
-        self.scale = scale
-        self.running = threading.Event()
-        self.running.set()
-
-    def run(self):
-        while self.running.is_set():
-            if "DATA" in self.daq.query('WAV:STAT?'):
-                self.daq.send_command('WAV:DATA?')
-                result = self.daq.read_raw()
-                values = self.daq.convert_raw_values(result, self.scale)
-                self.data_queue.put(values)
-            time.sleep(0.001)
-
-    def pause(self):
-        self.daq.send_command('STOP')
-        self.running.clear()
-
-    def resume(self):
-        self.daq.send_command('RUN')
-        self.running.set()
-
-    def stop(self):
-        self.running.clear()
-        self.daq.send_command('STOP')
-        if "DATA" in self.daq.query('WAV:STAT?'):
-            self.daq.send_command('WAV:DATA?')
-            self.daq.read_raw()
-
-def update_plot(frame, y_data, lines, data_queue, sampling_rate):
-    if update_plot.pause:
-        for ax in axs:
-            ax.relim()
-            ax.autoscale_view()
-        frame.canvas.draw()
-        frame.canvas.flush_events()
+def update_plot(renderer, plot_buffer, lines, data_queue, ring):
+    # Drain every pending block into the ring buffer, then render once; while
+    # paused the blocks still go to the history and the display stays frozen
+    while not data_queue.empty():
+        slot = data_queue.get()
+        plot_buffer.append(ring.block(slot), ring.info[slot].host_time)
+        ring.release(slot)
+    if not plot_buffer.update_lines(lines):
         return lines
 
-    if not data_queue.empty():
-        while not data_queue.empty():
-            values = data_queue.get()
-            for i, line in enumerate(lines):
-                y_data[i].extend(values[i])
-                if len(y_data[i]) > 40000:
-                    y_data[i] = y_data[i][-40000:]
-                x_data = np.arange(len(y_data[i])) / sampling_rate * 1000
-                line.set_data(x_data, y_data[i])
-    else:
-        for ax in axs:
-            ax.relim()
-            ax.autoscale_view()
-        frame.canvas.draw()
-        frame.canvas.flush_events()
-
+    renderer.render()
     return lines
 
-update_plot.pause = False
-
 def on_pause(event):
-    update_plot.pause = not update_plot.pause
-    if update_plot.pause:
+    # Only the display pauses, the acquisition keeps streaming without a gap
+    if plot_buffer.state == plot_buffer.LIVE:
+        plot_buffer.freeze()
         pause_button.label.set_text('Resume')
-        daq_thread.pause()
     else:
+        plot_buffer.resume()
         pause_button.label.set_text('Pause')
-        daq_thread.resume()
+
+def on_key(event):
+    # While paused, [ and ] browse the history by half a window (the arrows belong to the toolbar)
+    if event.key == '[':
+        plot_buffer.scroll(-plot_buffer.buffer_size // 2)
+    elif event.key == ']':
+        plot_buffer.scroll(plot_buffer.buffer_size // 2)
 
 signal_name = ["5V", "3V3", "2V7", "1V8", "1V2", "1V2_S", "VUSB_S", "1V2_CAM", "1V8_CAM", "3V3_PDCD", "VUSB_POWER"]
 
 if __name__ == "__main__":
     usb_address = "USB0::0x0957::0x1118::TW47031015::0::INSTR"  # Replace with actual USB address
     dac = KeysightDAC(usb_address)
-    data = []
     lines = []
-    data_queue = queue.Queue()
 
     dac.connect()
     dac.define_sampling_rate(8000)  # smooth display with 10 channels
@@ -230,14 +60,15 @@ if __name__ == "__main__":
     for channel in scanlist:
         dac.configure_output(channel, dac.VOLTAGE_RANGE_10V, dac.CHANNEL_UNIPOLAR_MODE)
 
-    dac.send_command('RUN')
-    
-    while "DATA" not in dac.query('WAV:STAT?'):
-        time.sleep(0.1)
+    dac.start_acquisition()
+    dac.wait_for_data()
 
-    sampling_rate = dac.get_sampling_rate()
+    sampling_rate = dac.sampling_rate
 
-    daq_thread = DataAcquisitionThread(dac, data_queue, scanlist, dac.VOLTAGE_RANGE_10V)
+    ring = BlockRing.for_daq(dac)
+    # Display only: drop the oldest blocks rather than letting the backlog grow
+    data_queue = BlockQueue(ring.slot_nbr // 2, BlockQueue.DROP_OLDEST, on_drop=ring.release)
+    daq_thread = DataAcquisitionThread(dac, data_queue, scanlist, ring)
     daq_thread.start()
 
     fig, axs = plt.subplots(6, 2, figsize=(15, 10))
@@ -247,8 +78,10 @@ if __name__ == "__main__":
         line, = axs[idx].plot([], [], lw=1, label=f"{signal_name[idx]}")
         axs[idx].set_title(f"{signal_name[idx]}")
         axs[idx].grid()
+        axs[idx].set_xlim(0, (buffer_size / sampling_rate) * 1000)
         lines.append(line)
-        data.append([])
+    plot_buffer = PlotBuffer(len(scanlist), buffer_size, sampling_rate, history_size=10 * buffer_size)
+    renderer = BlitRenderer(fig, lines)
 
     plt.tight_layout()
 
@@ -257,19 +90,23 @@ if __name__ == "__main__":
     ax_pause = plt.axes([0.85, 0.005, 0.025, 0.02])
     pause_button = Button(ax_pause, 'Pause')
     pause_button.on_clicked(on_pause)
+    fig.canvas.mpl_connect('key_press_event', on_key)
     
     plt.rcParams['figure.dpi'] = 600
     plt.rcParams['savefig.dpi'] = 600
     plt.show()
         
+    scheduler = RenderScheduler(target_fps=30)
+
     try:
-        while True:
-            time.sleep(0.005)
-            now = time.time()
-            lines = update_plot(fig, data, lines, data_queue, sampling_rate)
-            end = time.time() - now
-            print(data_queue.qsize())
-            print(end)  
+        while plt.fignum_exists(fig.number):
+            render_start = scheduler.wait(fig.canvas)
+            lines = update_plot(renderer, plot_buffer, lines, data_queue, ring)
+            if plot_buffer.drawn_time is not None:
+                scheduler.record(render_start, plot_buffer.drawn_time)
+                plot_buffer.drawn_time = None
+            # In the window title: figure text would need a full redraw to change
+            fig.canvas.manager.set_window_title(f"{scheduler.status_text()} | queued {data_queue.qsize()}, dropped {data_queue.dropped}")
     except BaseException:
         print('error')            
     except KeyboardInterrupt:
@@ -280,3 +117,8 @@ if __name__ == "__main__":
     daq_thread.stop()
     daq_thread.join()
     dac.close()
+    print(daq_thread.stats.summary())
+    print(data_queue.summary())
+    print(scheduler.summary())
+    print(dac.serializer.summary())
+    print(f"{renderer.full_redraws} full redraws")
\ No newline at end of file
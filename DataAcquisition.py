@@ -0,0 +1,315 @@
+import bisect
+import threading
+import queue
+import time
+from collections import namedtuple
+import numpy as np
+
+# sequence: block number since the thread started, host_time: time.monotonic() when the block
+# was seen ready, status: WAV:STAT? answer it was read under
+BlockInfo = namedtuple('BlockInfo', ['sequence', 'host_time', 'status', 'sample_nbr', 'transfer_time', 'decode_time'])
+
+class LatencyCounter:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.last = value
+        self.max = max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self):
+        return {'count': self.count, 'mean': self.mean(), 'last': self.last, 'max': self.max}
+
+class LatencyHistogram:
+    """Fixed-bin histogram of durations, bins in milliseconds."""
+    EDGES = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+    def __init__(self):
+        self.counts = np.zeros(len(self.EDGES) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        milliseconds = value * 1000
+        # bisect on the tuple: np.searchsorted would convert EDGES on every call
+        self.counts[bisect.bisect_right(self.EDGES, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        """Upper edge (ms) of the bin holding the given percentile."""
+        if not self.count:
+            return 0.0
+        index = np.searchsorted(np.cumsum(self.counts), self.count * percent / 100)
+        return self.EDGES[index] if index < len(self.EDGES) else self.max
+
+    def summary(self):
+        labels = [f'<{edge}' for edge in self.EDGES] + [f'>={self.EDGES[-1]}']
+        return {
+            'count': self.count,
+            'mean_ms': self.mean(),
+            'max_ms': self.max,
+            'histogram_ms': {label: int(count) for label, count in zip(labels, self.counts) if count},
+        }
+
+class AcquisitionStats:
+    """
+    Running gap and latency accounting of a continuous acquisition.
+
+    A block read while WAV:STAT? reports OVER follows a buffer overrun: the
+    data before it is lost. overflow_blocks is an exact count of them;
+    estimated_dropped_blocks only estimates how many blocks were lost, from
+    the host time elapsed since the previous block, which includes USB and
+    polling jitter and any stall of the reader. A capture is gap free while
+    overflow_blocks stays at 0.
+    """
+    def __init__(self, block_period):
+        self.block_period = block_period
+        self.lock = threading.Lock()
+        self.blocks = 0
+        self.overflow_blocks = 0
+        self.estimated_dropped_blocks = 0
+        self.transfer = LatencyCounter()
+        self.decode = LatencyCounter()
+        self.last_info = None
+
+    def record(self, info, overflow):
+        with self.lock:
+            if overflow:
+                self.overflow_blocks += 1
+                missed = 1
+                if self.last_info is not None:
+                    missed = max(1, round((info.host_time - self.last_info.host_time) / self.block_period) - 1)
+                self.estimated_dropped_blocks += missed
+            self.blocks += 1
+            self.transfer.add(info.transfer_time)
+            self.decode.add(info.decode_time)
+            self.last_info = info
+
+    def is_gap_free(self):
+        return self.overflow_blocks == 0
+
+    def summary(self):
+        with self.lock:
+            return {
+                'blocks': self.blocks,
+                'overflow_blocks': self.overflow_blocks,
+                'estimated_dropped_blocks': self.estimated_dropped_blocks,
+                'transfer_latency': self.transfer.summary(),
+                'decode_latency': self.decode.summary(),
+            }
+
+class BlockRing:
+    """
+    Preallocated storage for a continuous acquisition.
+
+    Every slot holds one raw WAV:DATA? block and its decoded float32 values.
+    Producers take a free slot with acquire(), consumers hand it back with
+    release() once they are done, so the memory used never grows.
+    """
+    def __init__(self, slot_nbr, channel_nbr, sample_points, block_buffer_size):
+        self.slot_nbr = slot_nbr
+        self.raw = np.zeros((slot_nbr, block_buffer_size), dtype=np.uint8)
+        self.values = np.zeros((slot_nbr, channel_nbr, sample_points), dtype=np.float32)
+        self.sample_nbr = np.zeros(slot_nbr, dtype=np.int64)
+        self.info = [None] * slot_nbr
+        self.free_slots = queue.Queue()
+        for slot in range(slot_nbr):
+            self.free_slots.put(slot)
+
+    @classmethod
+    def for_daq(cls, daq, slot_nbr=8):
+        if daq.block_period is None:
+            daq.update_block_timing()
+        channel_nbr = len(daq.scanlist)
+        return cls(slot_nbr, channel_nbr, daq.sample_points, daq.block_buffer_size(channel_nbr, daq.sample_points))
+
+    def acquire(self, timeout=None):
+        return self.free_slots.get(timeout=timeout)
+
+    def release(self, slot):
+        self.free_slots.put(slot)
+
+    def block(self, slot):
+        return self.values[slot, :, :self.sample_nbr[slot]]
+
+class BlockQueue(queue.Queue):
+    """
+    Bounded handoff between DataAcquisitionThread and its consumer.
+
+    What happens when the consumer falls behind depends on policy:
+    - BLOCK: put() waits for room, nothing is lost on the host (logging)
+    - DROP_OLDEST: the oldest queued blocks are discarded to make room
+    - LATEST: every queued block is discarded, the consumer only sees the
+      newest one (display only)
+    Discarded items are counted in dropped and given to on_drop, e.g.
+    BlockRing.release so their slots are reused. full_waits counts the items
+    that found the queue full under BLOCK, once per item: a put() retried
+    after a timeout passes retry=True.
+    """
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    LATEST = 'latest'
+
+    def __init__(self, maxsize, policy=BLOCK, on_drop=None):
+        super().__init__(maxsize)
+        self.policy = policy
+        self.on_drop = on_drop
+        self.dropped = 0
+        self.full_waits = 0
+
+    def put(self, item, block=True, timeout=None, retry=False):
+        if self.policy == self.BLOCK:
+            if self.full() and not retry:
+                self.full_waits += 1
+            return super().put(item, block, timeout)
+
+        discarded = list()
+        with self.not_full:
+            if self.policy == self.LATEST:
+                limit = 1
+            else:
+                limit = self.maxsize if self.maxsize > 0 else None
+            while limit is not None and self._qsize() >= limit:
+                discarded.append(self._get())
+            self._put(item)
+            self.unfinished_tasks += 1 - len(discarded)
+            self.dropped += len(discarded)
+            self.not_empty.notify()
+
+        if self.on_drop is not None:
+            for dropped_item in discarded:
+                self.on_drop(dropped_item)
+
+    def summary(self):
+        return {'policy': self.policy, 'queued': self.qsize(), 'dropped': self.dropped, 'full_waits': self.full_waits}
+
+class DataAcquisitionThread(threading.Thread):
+    """
+    Read blocks from a KeysightDAC and hand them to data_queue, a BlockQueue.
+
+    Without a ring, every block is put on the queue as a (BlockInfo, values)
+    pair, values being a new (channels, samples) array. With a BlockRing the
+    blocks are read and decoded into its slots and only the slot index is
+    queued; the consumer gets the values with ring.block(slot), the BlockInfo
+    with ring.info[slot], and must ring.release(slot) afterwards.
+    Gap and latency counters are kept in stats.
+
+    Callbacks registered with add_observer(callback) are called as
+    callback(info, values) in this thread for every block, before it is
+    queued, so they see every block even when the consumer drops some.
+    They must not keep values, which may be a ring slot about to be reused.
+
+    pause(), resume() and stop() may be called from any thread: every request
+    goes through daq.serializer, which puts their STOP/RUN ahead of the
+    polling and never between WAV:DATA? and the read of its block.
+    """
+    def __init__(self, daq, data_queue, scanlist, ring=None):
+        super().__init__()
+        self.daq = daq
+        self.data_queue = data_queue
+        self.scanlist = scanlist
+        self.ring = ring
+        if daq.block_period is None:
+            daq.update_block_timing()
+        self.stats = AcquisitionStats(daq.block_period)
+        self.observers = list()
+        self.running = threading.Event()
+        self.running.set()
+        self.active = threading.Event()  # cleared while the instrument is paused
+        self.active.set()
+
+    def run(self):
+        while self.running.is_set():
+            if not self.active.wait(timeout=0.1):
+                continue
+            if self.ring is None:
+                if self.daq.wait_for_data(timeout=0.1):
+                    info, values = self.read_block()
+                    self.notify(info, values)
+                    self.hand_over((info, values))
+                continue
+
+            try:
+                slot = self.ring.acquire(timeout=0.1)
+            except queue.Empty:
+                continue
+            if self.daq.wait_for_data(timeout=0.1):
+                self.ring.info[slot], _ = self.read_block(self.ring.raw[slot], self.ring.values[slot])
+                self.ring.sample_nbr[slot] = self.ring.info[slot].sample_nbr
+                self.notify(self.ring.info[slot], self.ring.block(slot))
+                if not self.hand_over(slot):
+                    self.ring.release(slot)
+            else:
+                self.ring.release(slot)
+
+    def add_observer(self, callback):
+        self.observers.append(callback)
+
+    def notify(self, info, values):
+        for callback in self.observers:
+            callback(info, values)
+
+    def hand_over(self, item):
+        # Don't stay stuck on a full queue once stop() or pause() was called
+        retry = False
+        while self.running.is_set():
+            try:
+                self.data_queue.put(item, timeout=0.1, retry=retry)
+                return True
+            except queue.Full:
+                retry = True
+        return False
+
+    def read_block(self, raw_buffer=None, out=None):
+        sequence = self.stats.blocks
+        host_time = self.daq.ready_time
+        status = self.daq.last_status.strip()
+
+        start = time.perf_counter()
+        result = self.daq.fetch_block(raw_buffer)
+        transfer_end = time.perf_counter()
+        if out is None:
+            values = self.daq.convert_raw_values(result)
+            sample_nbr = values.shape[1]
+        else:
+            values = out
+            sample_nbr = self.daq.convert_raw_values_into(raw_buffer, out)
+        decode_end = time.perf_counter()
+
+        info = BlockInfo(sequence, host_time, status, sample_nbr, transfer_end - start, decode_end - transfer_end)
+        self.stats.record(info, self.daq.is_overflow(status))
+        return info, values
+
+    def pause(self):
+        """
+        Stop the instrument; the thread stays alive until stop().
+
+        Samples are lost until resume(). To only freeze a display, keep the
+        acquisition running and use PlotBuffer.freeze() instead.
+        """
+        self.active.clear()
+        self.daq.send_command('STOP')
+
+    def resume(self):
+        self.daq.start_acquisition()
+        self.active.set()
+
+    def stop(self):
+        self.running.clear()
+        self.daq.send_command('STOP')
+        if self.daq.is_data_ready(self.daq.query('WAV:STAT?')):
+            self.daq.fetch_block()
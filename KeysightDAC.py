@@ -1,5 +1,10 @@
+import ctypes
 import pyvisa
+from pyvisa import constants
+import time
+import os
 import numpy as np
+from CommandSerializer import CommandSerializer
 
 class KeysightDAC:
     ANALOG_CHANNEL_1 = 101
@@ -26,32 +31,73 @@ class KeysightDAC:
     
     CHANNEL_UNIPOLAR_MODE = 'UNIP'
     CHANNEL_BIPOLAR_MODE = 'BIP'
+
+    # WAV:DATA? answer: '#', digit count, up to 9 length digits, the codes, then '\n'
+    BLOCK_HEADER_SIZE = 11
+
+    # WAV:STAT? answers for which a block can be read with WAV:DATA?
+    DATA_READY_STATES = ('DATA', 'OVER')
+
+    MIN_POLL_INTERVAL = 0.0005  # seconds
+    MAX_POLL_INTERVAL = 0.02  # seconds
+
+    # Conversion tables shared by every instance, keyed by (range, polarity)
+    _lut_cache = dict()
     
     def __init__(self, usb_address):
         self.usb_address = usb_address
         self.resource_manager = pyvisa.ResourceManager()
         self.instrument = None
+        self.serializer = CommandSerializer()  # every request to instrument goes through it
         self.scanlist = None
+        self.channel_config = dict()  # channel -> (voltage_range, polarity)
+
+        # Block timing, see update_block_timing() and wait_for_data()
+        self.sampling_rate = None
+        self.sample_points = None
+        self.block_period = None
+        self.block_bytes = None
+        self.acquisition_start = None
+        self.blocks_read = 0
+        self.last_status = ''
+        self.ready_time = None
+        self.poll_count = 0
+        self.total_polls = 0
+        self._pending_polls = 0
+        self._csv_samples = dict()  # filename -> samples already exported
 
     def connect(self):
         self.instrument = self.resource_manager.open_resource(self.usb_address)
 
-    def send_command(self, command):
-        print(command)
-        self.instrument.write(command)
+    def send_command(self, command, priority=CommandSerializer.CONTROL):
+        with self.serializer.transaction(command, priority):
+            self.instrument.write(command)
 
-    def query(self, command):
-        return self.instrument.query(command)
+    def query(self, command, priority=CommandSerializer.POLLING):
+        with self.serializer.transaction(command, priority):
+            return self.instrument.query(command)
     
-    def read_raw(self):
+    def _read_raw(self):
+        # Only for the read of a response inside a transaction, see fetch_block
         return self.instrument.read_raw()
 
     def configure_output(self, channel, voltage_range, polarity):
         self.send_command(f'ROUT:CHAN:RANG {voltage_range}, (@{channel})')
         self.send_command(f'ROUT:CHAN:POL {polarity}, (@{channel})')
+        self.channel_config[channel] = (voltage_range, polarity)
         
     def get_voltage_range(self, channel):
-        return int(self.query(f"ROUT:CHAN:RANG? (@{channel})"))
+        voltage_range = float(self.query(f"ROUT:CHAN:RANG? (@{channel})"))
+        if channel in self.channel_config:
+            self.channel_config[channel] = (voltage_range, self.channel_config[channel][1])
+        return voltage_range
+
+    def get_polarity(self, channel):
+        return self.query(f"ROUT:CHAN:POL? (@{channel})").strip()
+
+    def read_channel_config(self, channel):
+        self.channel_config[channel] = (self.get_voltage_range(channel), self.get_polarity(channel))
+        return self.channel_config[channel]
         
     def configure_scanlist(self, channels):
         self.scanlist = list()
@@ -59,6 +105,7 @@ class KeysightDAC:
         
         if isinstance(channels, int):
             command += f'{channels})'
+            self.scanlist.append(channels)
         else:
             for a_channel in channels:
                 command += f'{a_channel},'
@@ -75,12 +122,15 @@ class KeysightDAC:
 
     def define_sampling_rate(self, rate):
         self.send_command(f"ACQuire:SRATe {rate}") # rate shall be in Hertz
+        self.sampling_rate = None
+        self.block_period = None
         
     def get_sampling_points(self):
         return self.query("WAV:POIN?")
     
     def define_sample_points(self, number_of_points):
         self.send_command(f"WAV:POIN {number_of_points}")
+        self.block_period = None
         target = self.get_sampling_points()
         
         if int(target) != number_of_points:
@@ -91,38 +141,280 @@ class KeysightDAC:
             self.instrument.close()
             
     def start_acquisition(self):
+        self.update_block_timing()
         self.send_command('RUN')
+        self.acquisition_start = time.monotonic()
+        self.blocks_read = 0
+        self.total_polls = 0
+        self._pending_polls = 0
         
     def stop_acquisition(self):
         self.send_command('STOP')
             
-    def convert_raw_values(self, raw_values, scale):
-        byte_nbr = int(raw_values[2:10].decode())  # Get the number of bytes
-        index = 10  # Start the index at 10
+    def update_block_timing(self):
+        """
+        Read back ACQ:SRAT and WAV:POIN to know how often a block is due.
+
+        A block holds WAV:POIN samples of every scanlist channel, so one is
+        ready every WAV:POIN / ACQ:SRAT seconds.
+        """
+        self.sampling_rate = self.get_sampling_rate()
+        self.sample_points = int(self.get_sampling_points())
+        self.block_period = self.sample_points / self.sampling_rate
+        self.block_bytes = 2 * self.sample_points * len(self.scanlist)
+
+    @classmethod
+    def block_buffer_size(cls, channel_nbr, sample_points):
+        """Bytes needed to read a whole WAV:DATA? answer of sample_points samples per channel."""
+        return cls.BLOCK_HEADER_SIZE + 2 * channel_nbr * sample_points + 1
+
+    def block_buffer(self):
+        """Preallocated buffer for fetch_block() with the current scanlist and WAV:POIN."""
+        if self.block_period is None:
+            self.update_block_timing()
+        return np.empty(self.block_buffer_size(len(self.scanlist), self.sample_points), dtype=np.uint8)
+
+    def is_data_ready(self, status):
+        return any(state in status for state in self.DATA_READY_STATES)
+
+    def is_overflow(self, status):
+        return 'OVER' in status
+
+    def wait_for_data(self, timeout=None):
+        """
+        Wait until a block can be read with WAV:DATA?.
+
+        Sleeps until shortly before the next block is due, then polls WAV:STAT?
+        with an exponential backoff bounded by MAX_POLL_INTERVAL. Returns True
+        when a block is ready, False when timeout (seconds) expired first;
+        WAV:STAT? is not queried at all when the block can't be due before the
+        timeout. The number of queries spent is kept in poll_count (last block
+        fetched) and total_polls (since start_acquisition).
+        """
+        if self.block_period is None:
+            self.update_block_timing()
+        if self.acquisition_start is None:
+            self.acquisition_start = time.monotonic()
+
+        now = time.monotonic()
+        deadline = None if timeout is None else now + timeout
+        guard = 0.05 * self.block_period
+        due = self.acquisition_start + (self.blocks_read + 1) * self.block_period
+        if deadline is not None and deadline < due - guard:
+            # Nothing can be ready before the deadline, don't touch the bus
+            if deadline > now:
+                time.sleep(deadline - now)
+            return False
+        if due - guard > now:
+            time.sleep(due - guard - now)
+
+        max_interval = max(self.MIN_POLL_INTERVAL, min(self.MAX_POLL_INTERVAL, guard))
+        interval = max(self.MIN_POLL_INTERVAL, min(max_interval, guard / 4))
+        polls = 0
+        while True:
+            self.last_status = self.query('WAV:STAT?')
+            polls += 1
+            self._pending_polls += 1
+            self.total_polls += 1
+            if self.is_data_ready(self.last_status):
+                break
+            if deadline is not None and time.monotonic() + interval > deadline:
+                return False
+            time.sleep(interval)
+            interval = min(2 * interval, max_interval)
+
+        # Keep the prediction locked on the instrument clock
+        self.ready_time = time.monotonic()
+        if polls > 1:
+            self.acquisition_start = self.ready_time - (self.blocks_read + 1) * self.block_period
+        else:
+            self.acquisition_start -= guard / 2
+        return True
+
+    def polls_per_block(self):
+        if self.blocks_read == 0:
+            return 0.0
+        return self.total_polls / self.blocks_read
+
+    def _read_raw_into(self, buffer):
+        """
+        Read one response into a preallocated buffer and return its length.
+
+        viRead of the ctypes backend writes straight into the buffer, so no
+        bytes object is allocated per block and chunk_size is left alone for
+        the other queries. A response longer than the buffer is drained and
+        raises ValueError. Other backends fall back to _read_raw() and a copy.
+        Like _read_raw(), it must run in the transaction of the query.
+        """
+        view = memoryview(buffer).cast('B')
+        visalib = self.instrument.visalib
+        if not hasattr(visalib, 'viRead'):
+            raw_values = self._read_raw()
+            if len(raw_values) > len(view):
+                raise ValueError(f"Response of {len(raw_values)} bytes does not fit in a {len(view)} bytes buffer")
+            view[:len(raw_values)] = raw_values
+            return len(raw_values)
+
+        count = ctypes.c_uint32()
+        byte_nbr = 0
+        while True:
+            remaining = len(view) - byte_nbr
+            target = (ctypes.c_char * remaining).from_buffer(view, byte_nbr)
+            status = visalib.viRead(self.instrument.session, target, remaining, ctypes.byref(count))
+            byte_nbr += count.value
+            if status != constants.StatusCode.success_max_count_read:
+                return byte_nbr
+            if byte_nbr == len(view):
+                # Don't leave the rest of the response for the next query to read
+                self._read_raw()
+                raise ValueError(f"Response longer than the {len(view)} bytes buffer")
+
+    def fetch_block(self, buffer=None):
+        """
+        Issue WAV:DATA? and read the block.
+
+        Returns the raw block, or its length when it was read into buffer. The
+        query and the read are a single request of the serializer.
+        """
+        with self.serializer.transaction('WAV:DATA?', CommandSerializer.POLLING):
+            self.instrument.write('WAV:DATA?')
+            if buffer is None:
+                raw_values = self._read_raw()
+            else:
+                raw_values = self._read_raw_into(buffer)
+        self.blocks_read += 1
+        self.poll_count = self._pending_polls
+        self._pending_polls = 0
+        return raw_values
+
+    @staticmethod
+    def parse_block_header(raw_values):
+        """
+        Parse an IEEE 488.2 definite length block header (#<n><length>).
+
+        Returns the offset of the first payload byte and the payload length in bytes.
+        """
+        digit_nbr = int(bytes(raw_values[1:2]))
+        byte_nbr = int(bytes(raw_values[2:2 + digit_nbr]))
+        return 2 + digit_nbr, byte_nbr
+
+    def raw_codes(self, raw_values):
+        """
+        Return the ADC codes of a WAV:DATA? block as a (channels, samples) int16 view.
+
+        The payload is not copied: the interleaved little-endian samples are
+        viewed in place and de-interleaved with a reshape/transpose.
+        """
+        offset, byte_nbr = self.parse_block_header(raw_values)
         channel_nbr = len(self.scanlist)
+        sample_nbr = (byte_nbr // 2) // channel_nbr
+        codes = np.frombuffer(raw_values, dtype='<i2', count=sample_nbr * channel_nbr, offset=offset)
+        return codes.reshape(sample_nbr, channel_nbr).T
 
-        if channel_nbr == 1:
-            decimal_values = []
-            while index + 1 < 10 + byte_nbr:
-                combined_value = (raw_values[index + 1] << 8) | raw_values[index]
-                if combined_value & 0x8000 == 0:
-                    decimal_value = ((combined_value / 65536) + 0.5) * scale
-                else:
-                    decimal_value = ((combined_value & 0x7FFF) / 65536) * scale
-                decimal_values.append(decimal_value)
-                index += 2
-            return np.array(decimal_values)
-        
+    @classmethod
+    def conversion_table(cls, voltage_range, polarity, dtype=np.float64):
+        """
+        Return the 65536-entry code to volts table for a range/polarity pair.
+
+        The table is indexed by the unsigned 16-bit view of the ADC code.
+        Unipolar:  ((int16 / 65536) + 0.5) * range  ->  0 .. +range
+        Bipolar:   (int16 / 32768) * range          ->  -range .. +range
+        """
+        key = (float(voltage_range), polarity, np.dtype(dtype))
+        if key not in cls._lut_cache:
+            codes = np.arange(65536, dtype=np.uint16).view(np.int16)
+            if polarity == cls.CHANNEL_BIPOLAR_MODE:
+                table = (codes / 32768) * key[0]
+            else:
+                table = (codes / 65536 + 0.5) * key[0]
+            table = table.astype(dtype)
+            table.flags.writeable = False
+            cls._lut_cache[key] = table
+        return cls._lut_cache[key]
+
+    def scanlist_config(self):
+        """
+        Return the (ranges, polarities) lists of the scanlist channels, in scan order.
+
+        Channels never configured through configure_output are read back from
+        the instrument once.
+        """
+        for channel in self.scanlist:
+            if channel not in self.channel_config:
+                self.read_channel_config(channel)
+        ranges = [self.channel_config[channel][0] for channel in self.scanlist]
+        polarities = [self.channel_config[channel][1] for channel in self.scanlist]
+        return ranges, polarities
+
+    def scanlist_tables(self, dtype=np.float64):
+        """Return the conversion table of every scanlist channel, in scan order."""
+        return [self.conversion_table(voltage_range, polarity, dtype=dtype) for voltage_range, polarity in zip(*self.scanlist_config())]
+
+    def convert_raw_values(self, raw_values, scale=None):
+        """
+        Convert a WAV:DATA? block to volts.
+
+        Returns a (channels, samples) float array, one row per scanlist entry.
+        Each channel is converted with its own range and polarity through a
+        cached lookup table. Passing scale forces the same unipolar range on
+        every channel, as the scripts did before per-channel settings were kept.
+        """
+        codes = self.raw_codes(raw_values).view(np.uint16)
+        if scale is None:
+            tables = self.scanlist_tables()
         else:
-            decimal_values = [[] for _ in range(channel_nbr)]
-            channel_index = 0
-            while index + 1 < 10 + byte_nbr:
-                combined_value = (raw_values[index + 1] << 8) | raw_values[index]
-                if combined_value & 0x8000 == 0:
-                    decimal_value = ((combined_value / 65536) + 0.5) * scale
-                else:
-                    decimal_value = ((combined_value & 0x7FFF) / 65536) * scale
-                decimal_values[channel_index].append(decimal_value)
-                channel_index = (channel_index + 1) % channel_nbr
-                index += 2
-            return [np.array(vals) for vals in decimal_values]
\ No newline at end of file
+            tables = [self.conversion_table(scale, self.CHANNEL_UNIPOLAR_MODE)] * len(self.scanlist)
+
+        values = np.empty(codes.shape)
+        for row, table in enumerate(tables):
+            np.take(table, codes[row], out=values[row], mode='clip')
+        return values
+
+    def convert_raw_values_into(self, raw_values, out):
+        """
+        Convert a WAV:DATA? block into a preallocated (channels, samples) array.
+
+        Nothing is allocated per block: the codes are gathered through the
+        per-channel tables straight into out. Returns the number of samples
+        per channel written.
+        """
+        codes = self.raw_codes(raw_values).view(np.uint16)
+        sample_nbr = min(codes.shape[1], out.shape[1])
+        for row, table in enumerate(self.scanlist_tables(out.dtype)):
+            np.take(table, codes[row, :sample_nbr], out=out[row, :sample_nbr], mode='clip')
+        return sample_nbr
+
+    def export_to_csv(self, filename, data, signal_names=None, precision=6):
+        """
+        Export data to CSV file.
+
+        Parameters:
+        - filename: Name of the CSV file to save.
+        - data: List of data arrays to export, each array representing data for a channel.
+        - signal_names: Column names, 'Channel 1', 'Channel 2', ... by default.
+        - precision: Number of decimals written for the time (ms) and the values.
+
+        The header is only written when the file is new, and the time column
+        keeps counting across the blocks appended by this instance. The whole
+        block is formatted at once and written with a single write.
+        """
+        data = np.asarray(data)
+        channel_nbr, sample_nbr = data.shape
+        if signal_names is None:
+            signal_names = [f'Channel {index + 1}' for index in range(channel_nbr)]
+        if self.sampling_rate is None:
+            self.sampling_rate = self.get_sampling_rate()
+
+        first_sample = self._csv_samples.get(filename, 0)
+        self._csv_samples[filename] = first_sample + sample_nbr
+
+        table = np.empty((sample_nbr, channel_nbr + 1))
+        table[:, 0] = np.arange(first_sample, first_sample + sample_nbr) / self.sampling_rate * 1000  # Time in milliseconds
+        table[:, 1:] = data.T
+        row = ','.join([f'%.{precision}f'] * (channel_nbr + 1)) + '\n'
+
+        new_file = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        with open(filename, mode='a', newline='') as file:
+            if new_file:
+                file.write(','.join(['Time(ms)'] + list(signal_names)) + '\n')
+            file.write((row * sample_nbr) % tuple(table.ravel().tolist()))
@@ -0,0 +1,291 @@
+import time
+import numpy as np
+from DataAcquisition import LatencyHistogram
+
+def minmax_decimate(values, x_data, pixels):
+    """
+    Reduce (channels, samples) values to about 2 * pixels points per channel.
+
+    The samples are cut in pixels bins; each bin keeps its min and its max, in
+    the order they occurred, so a spike of a single sample is still drawn.
+    Returns (x, y) arrays of shape (channels, points).
+    """
+    sample_nbr = values.shape[1]
+    factor = sample_nbr // pixels
+    if factor < 2:
+        return np.broadcast_to(x_data[:sample_nbr], values.shape), values
+    complete = factor * pixels
+    bins = values[:, :complete].reshape(values.shape[0], pixels, factor)
+    first = bins.argmin(axis=2)
+    second = bins.argmax(axis=2)
+    swap = first > second
+    first[swap], second[swap] = second[swap], first[swap]
+    offsets = np.arange(pixels) * factor
+    indexes = np.stack((first + offsets, second + offsets), axis=2).reshape(values.shape[0], -1)
+    # The samples left after the last full bin are few, keep them as they are
+    tail = np.broadcast_to(np.arange(complete, sample_nbr), (values.shape[0], sample_nbr - complete))
+    indexes = np.concatenate((indexes, tail), axis=1)
+    return x_data[indexes], np.take_along_axis(values, indexes, axis=1)
+
+class PlotBuffer:
+    """
+    Fixed-size ring buffer of the last samples shown by a live view.
+
+    One (channels, history_size) float32 array receives the decoded blocks in
+    place, and the x-axis (milliseconds) is computed once. Blocks are appended
+    as the queue is drained; update_lines() then copies the displayed window
+    of buffer_size samples in time order into a second preallocated array and
+    calls set_data once per line, with at most two points per pixel of the
+    axes.
+
+    The display is LIVE or FROZEN. freeze() keeps showing the same window
+    while blocks are still appended, so nothing is lost; scroll() moves the
+    frozen window through the history_size samples kept, and resume() goes
+    back to the newest samples at once.
+    """
+    LIVE = 'live'
+    FROZEN = 'frozen'
+
+    def __init__(self, channel_nbr, buffer_size, sampling_rate, history_size=None):
+        self.channel_nbr = channel_nbr
+        self.buffer_size = buffer_size
+        self.history_size = max(buffer_size, history_size or buffer_size)
+        self.sampling_rate = sampling_rate
+        self.data = np.zeros((channel_nbr, self.history_size), dtype=np.float32)
+        self.ordered = np.zeros((channel_nbr, buffer_size), dtype=np.float32)
+        self.x_data = np.arange(buffer_size) / sampling_rate * 1000
+        self.head = 0  # Next column written
+        self.count = 0
+        self.total_samples = 0
+        self.state = self.LIVE
+        self.frozen_end = 0  # total_samples at the end of the frozen window
+        self.changed = False
+        self.pending_time = None  # host time of the oldest block not drawn yet
+        self.drawn_time = None
+
+    def append(self, values, host_time=None):
+        """
+        Append a (channels, samples) block, overwriting the oldest samples.
+
+        host_time is the time.monotonic() the block was seen ready, used to
+        measure the data-to-pixel latency.
+        """
+        sample_nbr = values.shape[1]
+        self.total_samples += sample_nbr
+        if self.state == self.LIVE:
+            self.changed = True
+            if self.pending_time is None:
+                self.pending_time = host_time
+        if sample_nbr >= self.history_size:
+            self.data[:] = values[:, -self.history_size:]
+            self.head = 0
+            self.count = self.history_size
+            return
+        first = min(sample_nbr, self.history_size - self.head)
+        self.data[:, self.head:self.head + first] = values[:, :first]
+        self.data[:, :sample_nbr - first] = values[:, first:]
+        self.head = (self.head + sample_nbr) % self.history_size
+        self.count = min(self.history_size, self.count + sample_nbr)
+
+    def freeze(self):
+        self.state = self.FROZEN
+        self.frozen_end = self.total_samples
+
+    def resume(self):
+        self.state = self.LIVE
+        self.changed = True
+
+    def scroll(self, samples):
+        """Move the frozen window by samples (negative goes back in time)."""
+        if self.state != self.FROZEN:
+            return
+        oldest = self.total_samples - self.count + min(self.count, self.buffer_size)
+        self.frozen_end = min(self.total_samples, max(oldest, self.frozen_end + samples))
+        self.changed = True
+
+    def delay(self):
+        """Samples between the end of the displayed window and the newest sample."""
+        if self.state == self.LIVE:
+            return 0
+        # The history may have moved past the frozen window, show its oldest part then
+        return min(self.total_samples - self.frozen_end, max(0, self.count - self.buffer_size))
+
+    def latest(self):
+        """Return the displayed window in time order, a view valid until the next call."""
+        delay = self.delay()
+        sample_nbr = min(self.buffer_size, self.count - delay)
+        start = (self.head - delay - sample_nbr) % self.history_size
+        first = min(sample_nbr, self.history_size - start)
+        self.ordered[:, :first] = self.data[:, start:start + first]
+        self.ordered[:, first:sample_nbr] = self.data[:, :sample_nbr - first]
+        return self.ordered[:, :sample_nbr]
+
+    def update_lines(self, lines, decimate=True):
+        """
+        Push the displayed window to the lines; returns False when it did not change.
+
+        With decimate, each channel is first reduced to a min/max envelope
+        sized to the pixel width of the axes, so the number of vertices
+        matplotlib strokes no longer depends on buffer_size.
+        """
+        if not self.changed:
+            return False
+        self.drawn_time, self.pending_time = self.pending_time, None
+        values = self.latest()
+        x_data = self.x_data[:values.shape[1]]
+        if decimate:
+            pixels = max(1, int(max(line.axes.bbox.width for line in lines)))
+            x_data, values = minmax_decimate(values, x_data, pixels)
+            for i, line in enumerate(lines):
+                line.set_data(x_data[i], values[i])
+        else:
+            for i, line in enumerate(lines):
+                line.set_data(x_data, values[i])
+        self.changed = False
+        return True
+
+class RenderScheduler:
+    """
+    Pace a live view at a target frame rate.
+
+    wait() keeps the GUI responsive until the next tick. When a frame took
+    longer than the period the ticks it overran are skipped, not caught up,
+    so a slow frame never causes a burst of redraws and the CPU use follows
+    target_fps rather than the data rate. record() feeds the histograms of
+    render time and data-to-pixel latency.
+    """
+    def __init__(self, target_fps=30):
+        self.period = 1 / target_fps
+        self.next_tick = time.monotonic()
+        self.start_time = self.next_tick
+        self.frames = 0
+        self.skipped = 0
+        self.render_time = LatencyHistogram()
+        self.latency = LatencyHistogram()
+
+    def wait(self, canvas=None):
+        remaining = self.next_tick - time.monotonic()
+        if remaining > 0:
+            if canvas is None:
+                time.sleep(remaining)
+            else:
+                canvas.start_event_loop(remaining)
+        missed = int((time.monotonic() - self.next_tick) // self.period)
+        self.skipped += max(0, missed)
+        self.next_tick += (max(0, missed) + 1) * self.period
+        return time.monotonic()
+
+    def record(self, render_start, data_time=None):
+        now = time.monotonic()
+        self.frames += 1
+        self.render_time.add(now - render_start)
+        if data_time is not None:
+            self.latency.add(now - data_time)
+
+    def fps(self):
+        elapsed = time.monotonic() - self.start_time
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def status_text(self):
+        return (f"{self.fps():.1f} fps, {self.skipped} skipped | render p95 < {self.render_time.percentile(95):g} ms"
+                f" | latency p95 < {self.latency.percentile(95):g} ms")
+
+    def summary(self):
+        return {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'fps': self.fps(),
+            'render_time': self.render_time.summary(),
+            'data_to_pixel_latency': self.latency.summary(),
+        }
+
+class BlitRenderer:
+    """
+    Redraw only the lines of a figure, over cached axes backgrounds.
+
+    The lines are animated: a full draw renders the static parts (ticks,
+    grids, titles) and the backgrounds of the axes are copied; every frame
+    then restores them, draws the lines and blits the axes boxes. The y-limits
+    follow the data with hysteresis: they are widened (with margin) when the
+    data leaves them and narrowed only when the data spans less than shrink
+    of the axis, so full redraws stay rare. Backends without blitting fall
+    back to a full draw.
+    """
+    def __init__(self, figure, lines, margin=0.25, shrink=0.25, min_span=0.01):
+        self.canvas = figure.canvas
+        self.margin = margin
+        self.shrink = shrink
+        self.min_span = min_span
+        self.axes_lines = dict()
+        for line in lines:
+            self.axes_lines.setdefault(line.axes, list()).append(line)
+        self.blit = getattr(self.canvas, 'supports_blit', False)
+        for line in lines:
+            line.set_animated(self.blit)
+        self.backgrounds = dict()
+        self.full_redraws = 0
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        # Any full draw (first show, resize, pause button) refreshes the backgrounds
+        if not self.blit:
+            return
+        self.backgrounds = {ax: self.canvas.copy_from_bbox(ax.bbox) for ax in self.axes_lines}
+        for ax, lines in self.axes_lines.items():
+            for line in lines:
+                ax.draw_artist(line)
+
+    def update_limits(self):
+        changed = False
+        for ax, lines in self.axes_lines.items():
+            y_data = [line.get_ydata() for line in lines if len(line.get_ydata())]
+            if not y_data:
+                continue
+            low = min(np.min(y) for y in y_data)
+            high = max(np.max(y) for y in y_data)
+            bottom, top = ax.get_ylim()
+            span = max(high - low, self.min_span)
+            if low < bottom or high > top or span < self.shrink * (top - bottom):
+                ax.set_ylim(low - self.margin * span, high + self.margin * span)
+                changed = True
+        return changed
+
+    def render(self):
+        if self.update_limits() or not self.blit or not self.backgrounds:
+            self.full_redraws += 1
+            self.canvas.draw()
+        else:
+            for ax, lines in self.axes_lines.items():
+                self.canvas.restore_region(self.backgrounds[ax])
+                for line in lines:
+                    ax.draw_artist(line)
+                self.canvas.blit(ax.bbox)
+        self.canvas.flush_events()
+
+class StatisticsPanel:
+    """
+    Table of RailStatistics drawn in an axes next to the plots.
+
+    Every rail has a row for the whole session and one for the sliding
+    window; update() only changes the cell texts.
+    """
+    COLUMNS = ('Min', 'Max', 'Mean', 'RMS', 'AC RMS', 'P-P')
+
+    def __init__(self, ax, statistics, fontsize=7):
+        self.statistics = statistics
+        ax.axis('off')
+        row_labels = list()
+        for name in statistics.signal_names:
+            row_labels += [f"{name} all", f"{name} {statistics.window:g} s"]
+        cell_text = [[''] * len(self.COLUMNS) for _ in row_labels]
+        self.table = ax.table(cellText=cell_text, rowLabels=row_labels, colLabels=self.COLUMNS, loc='center')
+        self.table.auto_set_font_size(False)
+        self.table.set_fontsize(fontsize)
+        self.cells = self.table.get_celld()
+
+    def update(self):
+        session, window = self.statistics.results()
+        for index in range(len(self.statistics.signal_names)):
+            for column, field in enumerate(self.statistics.FIELDS):
+                self.cells[2 * index + 1, column].get_text().set_text(f"{session[field][index]:.4f}")
+                self.cells[2 * index + 2, column].get_text().set_text(f"{window[field][index]:.4f}")
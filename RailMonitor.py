@@ -0,0 +1,229 @@
+import queue
+import re
+import threading
+from collections import namedtuple
+import numpy as np
+
+# rail: signal name, start/end: seconds since the monitor started (end exclusive),
+# duration: seconds, worst: the sample furthest from nominal, in volts
+Violation = namedtuple('Violation', ['rail', 'start', 'end', 'duration', 'worst'])
+
+def nominal_voltage(name):
+    """Nominal voltage read from a rail name: 3V3 -> 3.3, 1V2_CAM -> 1.2, VUSB -> 5.0; None if unknown."""
+    if name.startswith('VUSB'):
+        return 5.0
+    match = re.match(r'(\d+)V(\d*)', name)
+    if match is None:
+        return None
+    return float(f"{match.group(1)}.{match.group(2) or 0}")
+
+class RailLimit:
+    """
+    Allowed band of a rail: nominal +/- percent, nominal +/- delta volts, or
+    absolute low and high volts (which override the other two).
+    """
+    def __init__(self, nominal, percent=None, delta=None, low=None, high=None):
+        self.nominal = nominal
+        if percent is not None:
+            delta = abs(nominal) * percent / 100
+        delta = 0.0 if delta is None else delta
+        self.low = nominal - delta if low is None else low
+        self.high = nominal + delta if high is None else high
+
+    def __repr__(self):
+        return f"RailLimit({self.nominal}, low={self.low}, high={self.high})"
+
+def default_limits(signal_names, percent=5):
+    """RailLimit of +/- percent around the nominal voltage of every rail whose name gives one."""
+    limits = dict()
+    for name in signal_names:
+        nominal = nominal_voltage(name)
+        if nominal is not None:
+            limits[name] = RailLimit(nominal, percent=percent)
+    return limits
+
+class RailMonitor:
+    """
+    Check every sample of every rail against its RailLimit and log the violations.
+
+    update() is meant to be registered with DataAcquisitionThread.add_observer.
+    A block only costs a min and a max per channel while every rail is in its
+    band; the channels out of it are compared sample by sample and their runs
+    out of band found with vectorized diffs. Runs closer than gap seconds are
+    merged into one interval, state being carried across blocks, so a rail
+    chattering around its limit gives a single Violation rather than
+    thousands.
+
+    Every closed interval is appended to the log (CSV, one line per
+    violation, line buffered so a crash loses none) and put on the events
+    queue, where it is dropped and counted in dropped_events when the
+    consumer lags; per-rail totals are in summary(). Nothing is kept of the
+    samples.
+    """
+    LOG_HEADER = 'Rail,Start(s),End(s),Duration(ms),Worst(V),Low(V),High(V)\n'
+
+    def __init__(self, signal_names, sampling_rate, limits=None, gap=0.0, log=None, max_events=64):
+        self.signal_names = list(signal_names)
+        self.sampling_rate = sampling_rate
+        self.limits = default_limits(self.signal_names) if limits is None else dict(limits)
+        self.channels = [index for index, name in enumerate(self.signal_names) if name in self.limits]
+        self.nominal = np.array([self.limits[self.signal_names[index]].nominal for index in self.channels])
+        self.low = np.array([self.limits[self.signal_names[index]].low for index in self.channels])
+        self.high = np.array([self.limits[self.signal_names[index]].high for index in self.channels])
+        self.gap = int(round(gap * sampling_rate))
+        self.total_samples = 0
+        self.open = dict()  # position in channels -> [start, end, worst] of the interval not closed yet
+        self.lock = threading.Lock()
+        self.events = queue.Queue(maxsize=max_events)
+        self.dropped_events = 0
+        self.counts = np.zeros(len(self.channels), dtype=np.int64)
+        self.out_samples = np.zeros(len(self.channels), dtype=np.int64)
+        self.worst = np.array(self.nominal, dtype=np.float64)
+        self.log = None
+        if log is not None:
+            self.log = open(log, 'w', buffering=1)
+            self.log.write(self.LOG_HEADER)
+
+    def update(self, info, values):
+        offset = self.total_samples
+        self.total_samples += values.shape[1]
+        if not self.channels or values.shape[1] == 0:
+            return
+        out = (values.min(axis=1)[self.channels] < self.low) | (values.max(axis=1)[self.channels] > self.high)
+        for position in np.flatnonzero(out).tolist():
+            self.check(position, values[self.channels[position]], offset)
+
+        # Close the intervals the signal did not come back to within gap
+        for position in [position for position, interval in self.open.items() if self.total_samples - interval[1] > self.gap]:
+            self.close(position)
+
+    def check(self, position, x, offset):
+        nominal, low, high = self.nominal[position], self.low[position], self.high[position]
+        outside = (x < low) | (x > high)
+        steps = np.diff(outside.view(np.int8), prepend=0, append=0)
+        starts = np.flatnonzero(steps == 1)
+        ends = np.flatnonzero(steps == -1)
+
+        # Extremes of every run: the samples in band between runs can't win
+        maxs = np.maximum.reduceat(np.where(outside, x, -np.inf), starts)
+        mins = np.minimum.reduceat(np.where(outside, x, np.inf), starts)
+
+        # Merge the runs separated by at most gap samples
+        split = np.flatnonzero(starts[1:] - ends[:-1] > self.gap) + 1
+        first = np.concatenate(([0], split))
+        maxs = np.maximum.reduceat(maxs, first)
+        mins = np.minimum.reduceat(mins, first)
+        worst = np.where(maxs - nominal >= nominal - mins, maxs, mins)
+        starts = starts[first] + offset
+        ends = ends[np.concatenate((split - 1, [len(ends) - 1]))] + offset
+
+        intervals = [[start, end, value] for start, end, value in zip(starts.tolist(), ends.tolist(), worst.tolist())]
+        closed = list()
+        interval = self.open.pop(position, None)
+        if interval is not None:
+            if intervals[0][0] - interval[1] <= self.gap:
+                interval[1] = intervals[0][1]
+                interval[2] = self.worse(nominal, interval[2], intervals[0][2])
+                intervals[0] = interval
+            else:
+                closed.append(interval)
+        self.open[position] = intervals.pop()
+        self.record(position, closed + intervals)
+
+    @staticmethod
+    def worse(nominal, a, b):
+        return a if abs(a - nominal) >= abs(b - nominal) else b
+
+    def close(self, position):
+        self.record(position, [self.open.pop(position)])
+
+    def record(self, position, intervals):
+        """Publish and log the closed intervals of one rail, a single log write per block."""
+        if not intervals:
+            return
+        rail = self.signal_names[self.channels[position]]
+        violations = [Violation(rail, start / self.sampling_rate, end / self.sampling_rate, (end - start) / self.sampling_rate, worst)
+                      for start, end, worst in intervals]
+        for index, violation in enumerate(violations):
+            try:
+                self.events.put_nowait(violation)
+            except queue.Full:
+                self.dropped_events += len(violations) - index
+                break
+        with self.lock:
+            self.counts[position] += len(intervals)
+            self.out_samples[position] += sum(end - start for start, end, _ in intervals)
+            for _, _, worst in intervals:
+                self.worst[position] = self.worse(self.nominal[position], self.worst[position], worst)
+        if self.log is not None:
+            limits = f"{self.low[position]:.6f},{self.high[position]:.6f}"
+            self.log.write(''.join(f"{rail},{violation.start:.6f},{violation.end:.6f},{violation.duration * 1000:.3f},{violation.worst:.6f},{limits}\n"
+                                   for violation in violations))
+
+    def finish(self):
+        """Close the intervals still open and the log, at the end of the capture."""
+        for position in list(self.open):
+            self.close(position)
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def summary(self):
+        with self.lock:
+            return {
+                self.signal_names[index]: {
+                    'low': float(self.low[position]),
+                    'high': float(self.high[position]),
+                    'violations': int(self.counts[position]),
+                    'out_of_band_s': float(self.out_samples[position] / self.sampling_rate),
+                    'worst': float(self.worst[position]),
+                }
+                for position, index in enumerate(self.channels)
+            }
+
+if __name__ == "__main__":
+    from KeysightDAC import KeysightDAC
+    from DataAcquisition import BlockRing, BlockQueue, DataAcquisitionThread
+
+    usb_address = "USB0::0x0957::0x1118::TW47031015::0::INSTR"  # Replace with actual USB address
+    signal_name = ["5V", "3V3", "2V7", "1V8", "1V2", "1V2_S", "VUSB_S", "1V2_CAM", "1V8_CAM", "3V3_PDCD", "VUSB"]
+    dac = KeysightDAC(usb_address)
+    dac.connect()
+
+    scanlist = [dac.ANALOG_CHANNEL_1, dac.ANALOG_CHANNEL_2, dac.ANALOG_CHANNEL_3, dac.ANALOG_CHANNEL_4, dac.ANALOG_CHANNEL_5, dac.ANALOG_CHANNEL_6, dac.ANALOG_CHANNEL_7, dac.ANALOG_CHANNEL_8, dac.ANALOG_CHANNEL_9, dac.ANALOG_CHANNEL_10, dac.ANALOG_CHANNEL_11]
+    dac.configure_scanlist(scanlist)
+    dac.define_sampling_rate(40000)
+    dac.define_sample_points(20000)
+    for channel in scanlist:
+        dac.configure_output(channel, dac.VOLTAGE_RANGE_10V, dac.CHANNEL_UNIPOLAR_MODE)
+    dac.start_acquisition()
+    dac.wait_for_data()
+
+    # +/- 5 % on every rail, USB as per its specification
+    limits = default_limits(signal_name)
+    limits["VUSB"] = limits["VUSB_S"] = RailLimit(5.0, low=4.75, high=5.25)
+    monitor = RailMonitor(signal_name, dac.sampling_rate, limits, gap=0.001, log='violations.csv')
+
+    ring = BlockRing.for_daq(dac)
+    data_queue = BlockQueue(ring.slot_nbr // 2, BlockQueue.LATEST, on_drop=ring.release)
+    daq_thread = DataAcquisitionThread(dac, data_queue, scanlist, ring)
+    daq_thread.add_observer(monitor.update)
+    daq_thread.start()
+
+    try:
+        while True:
+            try:
+                ring.release(data_queue.get(timeout=0.1))
+            except queue.Empty:
+                pass
+            while not monitor.events.empty():
+                violation = monitor.events.get()
+                print(f"{violation.rail}: {violation.start:.6f} s for {violation.duration * 1000:.3f} ms, worst {violation.worst:.4f} V")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daq_thread.stop()
+        daq_thread.join()
+        dac.close()
+        monitor.finish()
+        print(monitor.summary())
@@ -0,0 +1,93 @@
+import threading
+from collections import deque
+import numpy as np
+
+class BlockMoments:
+    """
+    Count, mean, sum of squared deviations, min and max per channel.
+
+    Blocks are reduced with vectorized numpy calls and merged with the
+    parallel form of Welford's update, which stays accurate for long sessions
+    where a plain sum of squares would lose the small AC part of a DC rail.
+    """
+    def __init__(self, channel_nbr):
+        self.count = 0
+        self.mean = np.zeros(channel_nbr)
+        self.m2 = np.zeros(channel_nbr)
+        self.min = np.full(channel_nbr, np.inf)
+        self.max = np.full(channel_nbr, -np.inf)
+
+    @classmethod
+    def of_block(cls, values):
+        moments = cls(values.shape[0])
+        moments.count = values.shape[1]
+        if moments.count:
+            moments.mean = values.mean(axis=1, dtype=np.float64)
+            moments.m2 = np.square(values - moments.mean[:, None].astype(values.dtype)).sum(axis=1, dtype=np.float64)
+            moments.min = values.min(axis=1).astype(np.float64)
+            moments.max = values.max(axis=1).astype(np.float64)
+        return moments
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self.m2 = self.m2 + other.m2 + delta * delta * (self.count * other.count / count)
+        self.count = count
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+
+    def results(self):
+        """Return a dict of per-channel arrays: min, max, mean, rms, ac_rms, p2p."""
+        variance = self.m2 / self.count if self.count else np.zeros_like(self.m2)
+        return {
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'rms': np.sqrt(self.mean * self.mean + variance),
+            'ac_rms': np.sqrt(variance),
+            'p2p': self.max - self.min,
+        }
+
+class RailStatistics:
+    """
+    Running statistics of every rail over the session and a sliding window.
+
+    update() is meant to be registered with DataAcquisitionThread.add_observer
+    so every block is counted, displayed or not. Nothing is kept of the
+    samples: the session is a single BlockMoments and the window a bounded
+    deque of per-block moments covering at least window seconds.
+    """
+    FIELDS = ('min', 'max', 'mean', 'rms', 'ac_rms', 'p2p')
+
+    def __init__(self, signal_names, sampling_rate, window=1.0):
+        self.signal_names = list(signal_names)
+        self.window = window
+        self.window_samples = max(1, int(window * sampling_rate))
+        self.lock = threading.Lock()
+        self.session = BlockMoments(len(self.signal_names))
+        self.window_blocks = deque()
+        self.window_count = 0
+
+    def update(self, info, values):
+        block = BlockMoments.of_block(values)
+        with self.lock:
+            self.session.merge(block)
+            self.window_blocks.append(block)
+            self.window_count += block.count
+            while self.window_count - self.window_blocks[0].count >= self.window_samples:
+                self.window_count -= self.window_blocks.popleft().count
+
+    def results(self):
+        """Return (session, window) dicts of per-channel arrays."""
+        with self.lock:
+            window = BlockMoments(len(self.signal_names))
+            for block in self.window_blocks:
+                window.merge(block)
+            return self.session.results(), window.results()
+
+    def summary(self):
+        session, window = self.results()
+        return {name: {field: float(session[field][index]) for field in self.FIELDS} for index, name in enumerate(self.signal_names)}
@@ -0,0 +1,121 @@
+import json
+import time
+import numpy as np
+from KeysightDAC import KeysightDAC
+
+class RawRecorder:
+    """
+    Record a continuous acquisition as raw WAV:DATA? payloads.
+
+    Nothing is decoded while recording: the int16 codes of every block are
+    appended unchanged to <filename>.raw and one line per block (offset,
+    length, host time, WAV:STAT? answer) to the <filename>.idx sidecar, whose
+    first line holds the scanlist, ranges, polarities and sample rate needed
+    to decode later with RawRecording.
+    """
+    def __init__(self, daq, filename, buffer_size=1 << 22):
+        self.daq = daq
+        self.filename = filename
+        if daq.block_period is None:
+            daq.update_block_timing()
+
+        self.data_file = open(f'{filename}.raw', 'wb', buffering=buffer_size)
+        self.index_file = open(f'{filename}.idx', 'w')
+        self.offset = 0
+        self.blocks = 0
+
+        ranges, polarities = daq.scanlist_config()
+        metadata = {
+            'scanlist': daq.scanlist,
+            'ranges': ranges,
+            'polarities': polarities,
+            'sampling_rate': daq.sampling_rate,
+            'sample_points': daq.sample_points,
+            'start_time': time.time(),
+        }
+        self.index_file.write(json.dumps(metadata) + '\n')
+
+    def write_block(self, raw_values, host_time=None, status=''):
+        offset, byte_nbr = self.daq.parse_block_header(raw_values)
+        self.data_file.write(memoryview(raw_values)[offset:offset + byte_nbr])
+        self.index_file.write(json.dumps([self.offset, byte_nbr, host_time, status]) + '\n')
+        self.offset += byte_nbr
+        self.blocks += 1
+
+    def record(self, duration=None, running=None):
+        """
+        Read and store blocks until duration (seconds) elapsed or the running
+        threading.Event is cleared.
+        """
+        raw = self.daq.block_buffer()
+        end = None if duration is None else time.monotonic() + duration
+        while (end is None or time.monotonic() < end) and (running is None or running.is_set()):
+            if self.daq.wait_for_data(timeout=0.1):
+                host_time = self.daq.ready_time
+                status = self.daq.last_status.strip()
+                byte_nbr = self.daq.fetch_block(raw)
+                self.write_block(raw[:byte_nbr], host_time, status)
+
+    def close(self):
+        self.data_file.close()
+        self.index_file.close()
+
+class RawRecording:
+    """
+    Lazy reader of a RawRecorder capture.
+
+    The payload is memory mapped as a (samples, channels) int16 array and only
+    the requested samples are converted to volts.
+    """
+    def __init__(self, filename):
+        with open(f'{filename}.idx') as index_file:
+            self.metadata = json.loads(index_file.readline())
+            self.index = [json.loads(line) for line in index_file if line.strip()]
+
+        self.scanlist = self.metadata['scanlist']
+        self.sampling_rate = self.metadata['sampling_rate']
+        self.tables = [KeysightDAC.conversion_table(voltage_range, polarity, np.float32) for voltage_range, polarity in zip(self.metadata['ranges'], self.metadata['polarities'])]
+
+        channel_nbr = len(self.scanlist)
+        codes = np.memmap(f'{filename}.raw', dtype='<i2', mode='r')
+        self.codes = codes[:len(codes) // channel_nbr * channel_nbr].reshape(-1, channel_nbr)
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def to_volts(self, start=0, stop=None):
+        """Return samples [start, stop) as a (channels, samples) float32 array."""
+        codes = self.codes[start:stop].view(np.uint16)
+        values = np.empty((codes.shape[1], codes.shape[0]), dtype=np.float32)
+        for row, table in enumerate(self.tables):
+            np.take(table, codes[:, row], out=values[row], mode='clip')
+        return values
+
+    def blocks(self):
+        """Yield (host_time, status, values) for every recorded block."""
+        channel_nbr = len(self.scanlist)
+        for offset, byte_nbr, host_time, status in self.index:
+            start = offset // (2 * channel_nbr)
+            yield host_time, status, self.to_volts(start, start + byte_nbr // (2 * channel_nbr))
+
+if __name__ == "__main__":
+    usb_address = "USB0::0x0957::0x1118::TW47031015::0::INSTR"  # Replace with actual USB address
+    dac = KeysightDAC(usb_address)
+    dac.connect()
+
+    scanlist = [dac.ANALOG_CHANNEL_1, dac.ANALOG_CHANNEL_2, dac.ANALOG_CHANNEL_3, dac.ANALOG_CHANNEL_4, dac.ANALOG_CHANNEL_5, dac.ANALOG_CHANNEL_6, dac.ANALOG_CHANNEL_7, dac.ANALOG_CHANNEL_8, dac.ANALOG_CHANNEL_9, dac.ANALOG_CHANNEL_10, dac.ANALOG_CHANNEL_11]
+    dac.configure_scanlist(scanlist)
+    dac.define_sampling_rate(45000)  # 11 channels x 45 kS/s, close to the 500 kS/s aggregate
+    dac.define_sample_points(45000)
+    for channel in scanlist:
+        dac.configure_output(channel, dac.VOLTAGE_RANGE_10V, dac.CHANNEL_UNIPOLAR_MODE)
+
+    recorder = RawRecorder(dac, 'capture')
+    dac.start_acquisition()
+    try:
+        recorder.record(duration=60)
+    finally:
+        dac.stop_acquisition()
+        recorder.close()
+        dac.close()
+    print(f"{recorder.blocks} blocks, {recorder.offset} bytes recorded, {dac.polls_per_block():.1f} polls per block")
@@ -0,0 +1,268 @@
+import queue
+import time
+from collections import namedtuple
+import numpy as np
+
+# trigger: the condition that fired, sample_index: sample number since the acquisition
+# start, time: sample_index / sampling rate, values: (channels, pre + post) volts, the
+# trigger sample being values[:, pre] (NaN before the first acquired sample)
+TriggerEvent = namedtuple('TriggerEvent', ['trigger', 'sample_index', 'time', 'values'])
+
+def zone_changes(zones, history):
+    """
+    Compress a block of zone numbers to the positions where the zone changes.
+
+    history holds the last compressed zones of the previous blocks, they are
+    returned first with position -1. Returns (zones, positions).
+    """
+    previous = history[-1] if len(history) else -1
+    changes = np.flatnonzero(np.diff(zones, prepend=previous))
+    return np.concatenate((history, zones[changes])), np.concatenate((np.full(len(history), -1), changes))
+
+def schmitt_crossings(x, low, high, state):
+    """
+    Find the crossings of a Schmitt trigger: up when x reaches high after
+    being below low, down when x falls below low after being at or above high.
+
+    state is the last side seen (0 low, 2 high or None). Returns (up, down,
+    state), up and down being sample positions in x.
+    """
+    definite = np.flatnonzero((x < low) | (x >= high))
+    if len(definite) == 0:
+        return definite, definite, state
+    zones = np.where(x[definite] >= high, 2, 0)
+    previous = zones[0] if state is None else state
+    steps = np.diff(zones, prepend=previous)
+    return definite[steps > 0], definite[steps < 0], int(zones[-1])
+
+class EdgeTrigger:
+    """
+    Fire when channel crosses level.
+
+    slope is 'rising', 'falling' or 'either'. With hysteresis, the signal has
+    to go back beyond level -/+ hysteresis before the next edge counts, so
+    noise around the level does not fire repeatedly.
+    """
+    def __init__(self, channel, level, slope='rising', hysteresis=0.0, name=None):
+        self.channel = channel
+        self.level = level
+        self.slope = slope
+        self.hysteresis = hysteresis
+        self.name = name or f"{slope} edge {level} V on {channel}"
+        self.rising_state = None
+        self.falling_state = None
+
+    def evaluate(self, x):
+        found = list()
+        if self.slope in ('rising', 'either'):
+            up, _, self.rising_state = schmitt_crossings(x, self.level - self.hysteresis, self.level, self.rising_state)
+            found.append(up)
+        if self.slope in ('falling', 'either'):
+            # Going below level is the falling edge, so the band sits above the level
+            _, down, self.falling_state = schmitt_crossings(x, self.level, self.level + self.hysteresis, self.falling_state)
+            found.append(down)
+        return np.sort(np.concatenate(found))
+
+class LevelTrigger:
+    """Fire while channel is above (or below) level; the holdoff of the engine paces it."""
+    def __init__(self, channel, level, above=True, name=None):
+        self.channel = channel
+        self.level = level
+        self.above = above
+        self.name = name or f"level {'>' if above else '<'} {level} V on {channel}"
+
+    def evaluate(self, x):
+        return np.flatnonzero(x > self.level if self.above else x < self.level)
+
+class WindowTrigger:
+    """Fire when channel leaves the [low, high] band."""
+    def __init__(self, channel, low, high, name=None):
+        self.channel = channel
+        self.low = low
+        self.high = high
+        self.name = name or f"out of [{low}, {high}] V on {channel}"
+        self.inside = True
+
+    def evaluate(self, x):
+        outside = (x < self.low) | (x > self.high)
+        entering = outside & ~np.concatenate(([not self.inside], outside[:-1]))
+        if len(x):
+            self.inside = not outside[-1]
+        return np.flatnonzero(entering)
+
+class RuntTrigger:
+    """
+    Fire on a runt pulse: a pulse crossing low that goes back without reaching
+    high ('positive'), or the same downwards from above high ('negative').
+
+    The trigger sample is where the runt ends.
+    """
+    def __init__(self, channel, low, high, polarity='positive', name=None):
+        self.channel = channel
+        self.low = low
+        self.high = high
+        self.polarity = polarity
+        self.name = name or f"{polarity} runt in [{low}, {high}] V on {channel}"
+        self.history = list()
+
+    def evaluate(self, x):
+        zones = np.ones(len(x), dtype=np.int8)
+        zones[x < self.low] = 0
+        zones[x > self.high] = 2
+        compressed, changes = zone_changes(zones, self.history)
+        self.history = list(compressed[-2:])
+
+        before, middle, after = compressed[:-2], compressed[1:-1], compressed[2:]
+        positive = (before == 0) & (middle == 1) & (after == 0)
+        negative = (before == 2) & (middle == 1) & (after == 2)
+        fired = {'positive': positive, 'negative': negative}.get(self.polarity, positive | negative)
+        return changes[2:][fired]
+
+class TriggerEngine:
+    """
+    Software trigger on the decoded block stream.
+
+    update() is meant to be registered with DataAcquisitionThread.add_observer.
+    Every condition is evaluated on its channel with vectorized comparisons,
+    state being carried from one block to the next so edges spanning two
+    blocks are not missed. A history ring of pre + post + one block keeps
+    enough samples to cut, for every trigger, pre samples before and post
+    samples after it on all channels. After a trigger, others are ignored
+    for holdoff samples (default post).
+
+    Completed captures are put on the events queue; when the consumer lags
+    they are dropped and counted in dropped_events.
+    """
+    def __init__(self, channel_nbr, sampling_rate, triggers, pre=1000, post=1000, holdoff=None, max_events=64):
+        self.channel_nbr = channel_nbr
+        self.sampling_rate = sampling_rate
+        self.triggers = list(triggers)
+        self.pre = pre
+        self.post = post
+        self.holdoff = post if holdoff is None else holdoff
+        self.history = np.full((channel_nbr, 0), np.nan, dtype=np.float32)
+        self.history_start = 0  # sample index of history[:, 0]
+        self.total_samples = 0
+        self.next_allowed = 0
+        self.pending = list()  # (trigger, sample_index) waiting for their post samples
+        self.events = queue.Queue(maxsize=max_events)
+        self.trigger_count = 0
+        self.dropped_events = 0
+        self.evaluate_time = 0.0
+
+    def update(self, info, values):
+        start = time.perf_counter()
+        sample_nbr = values.shape[1]
+        self.store(values)
+
+        candidates = list()
+        names = list()
+        for index, trigger in enumerate(self.triggers):
+            found = trigger.evaluate(values[trigger.channel])
+            candidates.append(found + (self.total_samples - sample_nbr))
+            names.append(np.full(len(found), index))
+        candidates = np.concatenate(candidates) if candidates else np.zeros(0, dtype=np.int64)
+        names = np.concatenate(names) if names else np.zeros(0, dtype=np.int64)
+        order = np.argsort(candidates, kind='stable')
+        candidates, names = candidates[order], names[order]
+
+        # Apply the holdoff by jumping from one accepted trigger to the next candidate
+        position = np.searchsorted(candidates, self.next_allowed)
+        while position < len(candidates):
+            sample_index = int(candidates[position])
+            self.pending.append((self.triggers[names[position]], sample_index))
+            self.trigger_count += 1
+            self.next_allowed = sample_index + max(1, self.holdoff)
+            position = np.searchsorted(candidates, self.next_allowed)
+
+        while self.pending and self.pending[0][1] + self.post <= self.total_samples:
+            self.emit(*self.pending.pop(0))
+        self.evaluate_time += time.perf_counter() - start
+
+    def store(self, values):
+        capacity = self.pre + self.post + values.shape[1]
+        if self.history.shape[1] != capacity:
+            # Resized on the first block (or a larger one), keeping the newest samples
+            history = np.full((self.channel_nbr, capacity), np.nan, dtype=np.float32)
+            kept = min(capacity, self.history.shape[1], self.total_samples)
+            if kept:
+                history[:, -kept:] = self.window(self.total_samples - kept, self.total_samples)
+            self.history = history
+        keep = self.history.shape[1] - values.shape[1]
+        self.history[:, :keep] = self.history[:, values.shape[1]:]
+        self.history[:, keep:] = values
+        self.total_samples += values.shape[1]
+        self.history_start = self.total_samples - self.history.shape[1]
+
+    def window(self, start, stop):
+        """Samples [start, stop) from the history, NaN before the first sample."""
+        out = np.full((self.channel_nbr, stop - start), np.nan, dtype=np.float32)
+        first = max(start, self.history_start, 0)
+        if first < stop:
+            out[:, first - start:] = self.history[:, first - self.history_start:stop - self.history_start]
+        return out
+
+    def emit(self, trigger, sample_index):
+        event = TriggerEvent(trigger.name, sample_index, sample_index / self.sampling_rate, self.window(sample_index - self.pre, sample_index + self.post))
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.dropped_events += 1
+
+    def summary(self):
+        return {
+            'triggers': self.trigger_count,
+            'dropped_events': self.dropped_events,
+            'samples': self.total_samples,
+            'evaluate_time': self.evaluate_time,
+        }
+
+if __name__ == "__main__":
+    from KeysightDAC import KeysightDAC
+    from DataAcquisition import BlockRing, BlockQueue, DataAcquisitionThread
+
+    usb_address = "USB0::0x0957::0x1118::TW47031015::0::INSTR"  # Replace with actual USB address
+    signal_name = ["5V", "3V3", "2V7", "1V8", "1V2", "1V2_S", "VUSB_S", "1V2_CAM", "1V8_CAM", "3V3_PDCD", "VUSB"]
+    dac = KeysightDAC(usb_address)
+    dac.connect()
+
+    scanlist = [dac.ANALOG_CHANNEL_1, dac.ANALOG_CHANNEL_2, dac.ANALOG_CHANNEL_3, dac.ANALOG_CHANNEL_4, dac.ANALOG_CHANNEL_5, dac.ANALOG_CHANNEL_6, dac.ANALOG_CHANNEL_7, dac.ANALOG_CHANNEL_8, dac.ANALOG_CHANNEL_9, dac.ANALOG_CHANNEL_10, dac.ANALOG_CHANNEL_11]
+    dac.configure_scanlist(scanlist)
+    dac.define_sampling_rate(40000)
+    dac.define_sample_points(20000)
+    for channel in scanlist:
+        dac.configure_output(channel, dac.VOLTAGE_RANGE_10V, dac.CHANNEL_UNIPOLAR_MODE)
+    dac.start_acquisition()
+    dac.wait_for_data()
+
+    # Brown-out and glitches of the 1V2_CAM rail
+    cam = signal_name.index("1V2_CAM")
+    triggers = [
+        EdgeTrigger(cam, 1.1, 'falling', hysteresis=0.02, name="1V2_CAM brown-out"),
+        WindowTrigger(cam, 1.14, 1.26, name="1V2_CAM out of 5%"),
+    ]
+    engine = TriggerEngine(len(scanlist), dac.sampling_rate, triggers, pre=4000, post=8000)
+
+    ring = BlockRing.for_daq(dac)
+    data_queue = BlockQueue(ring.slot_nbr // 2, BlockQueue.LATEST, on_drop=ring.release)
+    daq_thread = DataAcquisitionThread(dac, data_queue, scanlist, ring)
+    daq_thread.add_observer(engine.update)
+    daq_thread.start()
+
+    try:
+        while True:
+            try:
+                ring.release(data_queue.get(timeout=0.1))
+            except queue.Empty:
+                pass
+            while not engine.events.empty():
+                event = engine.events.get()
+                print(f"{event.time:.6f} s (sample {event.sample_index}): {event.trigger}")
+                np.savez(f"trigger_{event.sample_index}.npz", values=event.values, pre=engine.pre, sampling_rate=engine.sampling_rate, signal_names=signal_name)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daq_thread.stop()
+        daq_thread.join()
+        dac.close()
+        print(engine.summary())
@@ -1,8 +1,163 @@
+import os
 import time
 import subprocess
+import zipfile
+import numpy as np
 from KeysightDAC import KeysightDAC as pydaq
 
-def acquire_data_real_time(duration, sample_rate):
+class VCDWriter:
+    """
+    Stream analog channels to a Value Change Dump file.
+
+    Every scanlist channel is a real variable. Timestamps come from the sample
+    rate (timescale 1 ns), and only the values that changed since the previous
+    sample are written, so a run costs one pass of buffered disk I/O.
+    """
+    def __init__(self, filename, signal_names, sampling_rate, buffer_size=1 << 20):
+        self.file = open(filename, 'w', buffering=buffer_size)
+        self.sampling_rate = sampling_rate
+        # VCD identifiers are printable characters starting from '!'
+        self.identifiers = [chr(33 + index) for index in range(len(signal_names))]
+        self.last_values = np.full(len(signal_names), np.nan)
+        self.sample_nbr = 0
+
+        self.file.write(f"$date {time.strftime('%Y-%m-%d %H:%M:%S')} $end\n")
+        self.file.write("$version DAQ U2351A to VCD $end\n")
+        self.file.write("$timescale 1 ns $end\n")
+        self.file.write("$scope module signals $end\n")
+        for identifier, name in zip(self.identifiers, signal_names):
+            self.file.write(f"$var real 64 {identifier} {name.replace(' ', '_')} $end\n")
+        self.file.write("$upscope $end\n")
+        self.file.write("$enddefinitions $end\n")
+
+    def timestamps(self, start, stop):
+        return np.round(np.arange(start, stop) * (1e9 / self.sampling_rate)).astype(np.int64)
+
+    def write_values(self, values):
+        """Append a (channels, samples) block of volts."""
+        sample_nbr = values.shape[1]
+        if sample_nbr == 0:
+            return
+        previous = np.concatenate((self.last_values[:, None], values[:, :-1]), axis=1)
+        changed = values != previous
+        indexes = np.flatnonzero(changed.any(axis=0))
+        timestamps = self.timestamps(self.sample_nbr, self.sample_nbr + sample_nbr)
+
+        # One column of text per channel, empty where the value did not change
+        columns = [list(map('#{}\n'.format, timestamps[indexes].tolist()))]
+        for channel, identifier in enumerate(self.identifiers):
+            column = np.full(len(indexes), '', dtype=object)
+            rows = np.flatnonzero(changed[channel, indexes])
+            column[rows] = list(map(f'r{{:.6g}} {identifier}\n'.format, values[channel, indexes[rows]].tolist()))
+            columns.append(column)
+        self.file.write(''.join(map(''.join, zip(*columns))))
+
+        self.last_values = values[:, -1].astype(np.float64)
+        self.sample_nbr += sample_nbr
+
+    def close(self):
+        # Close with the end time so the last values keep their duration
+        self.file.write(f"#{self.timestamps(self.sample_nbr, self.sample_nbr + 1)[0]}\n")
+        self.file.close()
+
+class SessionWriter:
+    """
+    Stream analog channels to a sigrok session (.sr) archive.
+
+    The archive is a zip holding a version file, a metadata file naming the
+    analog channels and, per channel, analog-1-<channel>-<chunk> files of
+    little-endian float32 volts. Values are buffered and written chunk by
+    chunk, so PulseView opens the capture without a sigrok-cli conversion.
+    """
+    def __init__(self, filename, signal_names, sampling_rate, chunk_size=1 << 20):
+        self.signal_names = list(signal_names)
+        self.chunk_size = chunk_size
+        self.buffer = np.empty((len(self.signal_names), chunk_size), dtype='<f4')
+        self.buffered = 0
+        self.chunk = 0
+        self.sample_nbr = 0
+
+        self.archive = zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED)
+        self.archive.writestr('version', '2')
+        metadata = [
+            "[global]",
+            "sigrok version=0.5.2",
+            "",
+            "[device 1]",
+            f"samplerate={int(round(sampling_rate))} Hz",
+            f"total analog={len(self.signal_names)}",
+        ]
+        metadata += [f"analog{index + 1}={name}" for index, name in enumerate(self.signal_names)]
+        self.archive.writestr('metadata', '\n'.join(metadata) + '\n')
+
+    def write_values(self, values):
+        """Append a (channels, samples) block of volts."""
+        done = 0
+        while done < values.shape[1]:
+            count = min(self.chunk_size - self.buffered, values.shape[1] - done)
+            self.buffer[:, self.buffered:self.buffered + count] = values[:, done:done + count]
+            self.buffered += count
+            done += count
+            if self.buffered == self.chunk_size:
+                self.flush_chunk()
+        self.sample_nbr += values.shape[1]
+
+    def flush_chunk(self):
+        if self.buffered == 0:
+            return
+        self.chunk += 1
+        for index in range(len(self.signal_names)):
+            self.archive.writestr(f"analog-1-{index + 1}-{self.chunk}", self.buffer[index, :self.buffered].tobytes())
+        self.buffered = 0
+
+    def close(self):
+        self.flush_chunk()
+        self.archive.close()
+
+# Trace colors of the PulseView session shipped with the project (output.pvs)
+PULSEVIEW_COLORS = [4291076096, 4287045754, 4280306311, 4283341318, 4279638298, 4287582722, 4291559424, 4294277376, 4293776384, 4285780502, 4281623972, 4285878395]
+
+def write_pulseview_session(filename, signal_names):
+    """Write a PulseView .pvs showing every analog channel under its rail name."""
+    lines = list()
+    for index, name in enumerate(signal_names):
+        lines += [
+            f"[{name}]",
+            f"name={name}",
+            "enabled=true",
+            f"color={PULSEVIEW_COLORS[index % len(PULSEVIEW_COLORS)]}",
+            "conversion_type=0",
+            "conv_options=0",
+            "",
+        ]
+    lines += [
+        "[General]",
+        "decode_signals=0",
+        "views=1",
+        "meta_objs=0",
+        "",
+        "[view0]",
+        "segment_display_mode=1",
+    ]
+    for name in signal_names:
+        lines += [
+            f"{name}\\autoranging=1",
+            f"{name}\\display_type=2",
+            f"{name}\\div_height=39",
+            f"{name}\\neg_vdivs=1",
+            f"{name}\\pos_vdivs=1",
+            f"{name}\\scale_index=4",
+        ]
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def acquire_data_real_time(duration, sample_rate, filename='output.vcd', signal_names=None):
+    """
+    Record duration seconds of CH1/CH2 to filename.
+
+    A .sr filename gives a sigrok session with a matching .pvs next to it,
+    any other name a VCD file.
+    """
     usb_address = "USB0::0x0957::0x1118::TW47031015::0::INSTR"  # Remplacez par l'adresse USB réelle de votre DAC
     daq = pydaq(usb_address)
     daq.connect()
@@ -13,58 +168,31 @@ def acquire_data_real_time(duration, sample_rate):
     daq.configure_output(daq.ANALOG_CHANNEL_2, daq.VOLTAGE_RANGE_5V, daq.CHANNEL_UNIPOLAR_MODE)
     daq.start_acquisition()
 
+    if signal_names is None:
+        signal_names = [f"signal{index + 1}" for index in range(len(daq.scanlist))]
+    if filename.endswith('.sr'):
+        writer = SessionWriter(filename, signal_names, daq.sampling_rate)
+        write_pulseview_session(os.path.splitext(filename)[0] + '.pvs', signal_names)
+    else:
+        writer = VCDWriter(filename, signal_names, daq.sampling_rate)
+
     start_time = time.time()
-    vcd_data = "$date today $end\n"
-    vcd_data += "$version DAQ U2351A to VCD $end\n"
-    vcd_data += "$timescale 1 us $end\n"
-    vcd_data += "$scope module signals $end\n"
-    vcd_data += "$var wire 1 a signal1 $end\n"
-    vcd_data += "$var wire 1 b signal2 $end\n"
-    vcd_data += "$upscope $end\n"
-    vcd_data += "$enddefinitions $end\n"
-
-    timestamp = 0
-
-    while time.time() - start_time < duration:
-        status = daq.query('WAV:STAT?')
-        print(status)
-        if "DATA" in status:
-            daq.send_command('WAV:DATA?')
-            result = daq.read_raw()
-            channels_values = daq.convert_raw_values(result, daq.VOLTAGE_RANGE_5V)
-            
-            Channel_nbr = len(channels_values)
-            Value_nbr = len(channels_values[0])
-            
-            print(channels_values)
-            
-            
-            index = 0        
-            
-            while index < Value_nbr:
-                # print(channels_values[0][index])
-                # print(channels_values[1][index])
-                vcd_data += f"#{timestamp}\n"
-                vcd_data += f"b{channels_values[0][index]} a\n"
-                vcd_data += f"b{channels_values[1][index]} a\n"
-                timestamp += 1
-                index += 1
-
-
-        with open('output.sr', 'w') as f:
-            f.write(vcd_data)
-
-        time.sleep(1.0 / sample_rate)
-
-    daq.stop_acquisition()
+    try:
+        while time.time() - start_time < duration:
+            if daq.wait_for_data(timeout=duration - (time.time() - start_time)):
+                result = daq.fetch_block()
+                writer.write_values(daq.convert_raw_values(result))
+    finally:
+        writer.close()
+        daq.stop_acquisition()
 
 def visualize_vcd():
     subprocess.run(['sigrok-cli', '-i', 'output.vcd', '-o', 'output.sr'])
 
-# Paramètres d'acquisition
-duration = 50  # Durée en secondes
-sample_rate = 100  # Taux d'échantillonnage en Hz
+if __name__ == "__main__":
+    # Paramètres d'acquisition
+    duration = 50  # Durée en secondes
+    sample_rate = 100  # Taux d'échantillonnage en Hz
 
-# Acquisition et visualisation
-# visualize_vcd()
-acquire_data_real_time(duration, sample_rate)
+    # Acquisition et visualisation
+    acquire_data_real_time(duration, sample_rate, 'output.sr')
@@ -0,0 +1,21 @@
+import numpy as np
+from CaptureFile import CaptureWriter, CaptureFile
+
+def make_capture(path, sampling_rate, sample_nbr):
+    writer = CaptureWriter(str(path), [101, 102], ["3V3", "1V8"], [10, 10], ['UNIP', 'UNIP'], sampling_rate)
+    writer.write_codes(np.tile(np.arange(sample_nbr, dtype=np.int16), (2, 1)))
+    writer.close()
+    return CaptureFile(str(path))
+
+def test_sample_index_of_non_representable_times(tmp_path):
+    # 1.1 * 45000 is 49500.000000000007 in floating point
+    capture = make_capture(tmp_path / "capture.u2cap", 45000, 100000)
+    assert capture.sample_index(1.1) == 49500
+    assert capture.sample_index(0.3) == 13500
+    assert capture.sample_range(1.1, 2.0) == (49500, 90000)
+
+def test_time_slice_keeps_its_first_sample(tmp_path):
+    capture = make_capture(tmp_path / "capture.u2cap", 45000, 100000)
+    values = capture[1.1:2.0, "3V3"]
+    assert values.shape == (40500,)
+    assert values[0] == capture.volts(49500, 49501, ["3V3"])[0, 0]